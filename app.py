@@ -1,24 +1,98 @@
 import os
+import sys
 import uuid
 
-from flask import Flask, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+import click
+
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask_jwt_extended import create_access_token, jwt_required, get_current_user, get_jwt
 from werkzeug.exceptions import BadRequest
 from flask_migrate import Migrate
 from models import db, User, Organisation
 from validate import Validate
+from membership import Membership
+from pagination import decode_cursor, parse_limit, keyset_page
+from hashing import hasher, HashingBusy, default_workers
+from cache import model_cache
+from importer import UserImporter, iter_records
+from pooling import engine_options
+from routing import replica_router
+from tokens import token_state, TokenIdentity, CachingJWTManager
+from serializers import ORJSONProvider, user_to_dict, organisation_to_dict
+from etags import resource_etag, collection_etag, not_modified, tagged
+from streaming import KeysetStream, ndjson_body, json_body, gzip_body
+from search import OrganisationSearch
+from ratelimit import login_throttle, RateLimited
+from emailfilter import email_filter
+from instrumentation import request_metrics
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
 
 load_dotenv()
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
+app.json.sort_keys = False
 app.config['SECRET_KEY'] = os.getenv('APP_SECRET_KEY')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['SQLALCHEMY_REPLICA_URIS'] = list(filter(None, os.getenv('SQLALCHEMY_REPLICA_URIS', '').split(',')))
+app.config['REPLICA_STICKY_SECONDS'] = float(os.getenv('REPLICA_STICKY_SECONDS', 5))
+app.config['REPLICA_MAX_LAG'] = float(os.getenv('REPLICA_MAX_LAG', 10))
+app.config['JWT_STATELESS'] = os.getenv('JWT_STATELESS', '').lower() in ('1', 'true', 'yes')
+app.config['TOKEN_STATE_CACHE_TTL'] = float(os.getenv('TOKEN_STATE_CACHE_TTL', 5))
+app.config['JWT_ORG_CLAIMS'] = os.getenv('JWT_ORG_CLAIMS', '').lower() in ('1', 'true', 'yes')
+app.config['JWT_ORG_CLAIM_LIMIT'] = int(os.getenv('JWT_ORG_CLAIM_LIMIT', 32))
+app.config['JWT_DECODE_CACHE_SIZE'] = int(os.getenv('JWT_DECODE_CACHE_SIZE', 4096))
+app.config['LOGIN_RATE_PER_IP'] = int(os.getenv('LOGIN_RATE_PER_IP', 30))
+app.config['LOGIN_RATE_PER_EMAIL'] = int(os.getenv('LOGIN_RATE_PER_EMAIL', 10))
+app.config['LOGIN_RATE_BACKEND'] = os.getenv('LOGIN_RATE_BACKEND', 'memory')
+app.config['LOGIN_RATE_REDIS_URL'] = os.getenv('LOGIN_RATE_REDIS_URL')
+# Number of reverse proxies in front of the app whose X-Forwarded-For can be trusted
+app.config['PROXY_FIX_X_FOR'] = int(os.getenv('PROXY_FIX_X_FOR', 0))
+if app.config['PROXY_FIX_X_FOR']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+app.config['EMAIL_FILTER'] = os.getenv('EMAIL_FILTER', '').lower() in ('1', 'true', 'yes')
+app.config['EMAIL_FILTER_CAPACITY'] = int(os.getenv('EMAIL_FILTER_CAPACITY', 1000000))
+app.config['EMAIL_FILTER_ERROR_RATE'] = float(os.getenv('EMAIL_FILTER_ERROR_RATE', 0.01))
+app.config['EMAIL_FILTER_BACKEND'] = os.getenv('EMAIL_FILTER_BACKEND', 'memory')
+app.config['EMAIL_FILTER_REDIS_URL'] = os.getenv('EMAIL_FILTER_REDIS_URL')
+app.config['EMAIL_FILTER_REFRESH'] = float(os.getenv('EMAIL_FILTER_REFRESH', 300))
+app.config['EMAIL_FILTER_LOAD_TIMEOUT'] = float(os.getenv('EMAIL_FILTER_LOAD_TIMEOUT', 600))
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+app.config['HASH_WORKERS'] = int(os.getenv('HASH_WORKERS', default_workers()))
+app.config['HASH_QUEUE_SIZE'] = int(os.getenv('HASH_QUEUE_SIZE', 4 * (os.cpu_count() or 1)))
+app.config['HASH_RETRY_AFTER'] = int(os.getenv('HASH_RETRY_AFTER', 1))
+app.config['HASH_BULK_WORKERS'] = int(os.getenv('HASH_BULK_WORKERS', max(1, app.config['HASH_WORKERS'] // 2)))
+app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+app.config['PASSWORD_SALT_LENGTH'] = int(os.getenv('PASSWORD_SALT_LENGTH', 16))
+app.config['PAGE_SIZE'] = int(os.getenv('PAGE_SIZE', 50))
+app.config['MAX_PAGE_SIZE'] = int(os.getenv('MAX_PAGE_SIZE', 200))
+app.config['MAX_BULK_MEMBERS'] = int(os.getenv('MAX_BULK_MEMBERS', 5000))
+app.config['MAX_BATCH_USERS'] = int(os.getenv('MAX_BATCH_USERS', 100))
+app.config['SEARCH_LIMIT'] = int(os.getenv('SEARCH_LIMIT', 20))
+app.config['SEARCH_THRESHOLD'] = float(os.getenv('SEARCH_THRESHOLD', 0.6))
+app.config['SEARCH_SCAN_LIMIT'] = int(os.getenv('SEARCH_SCAN_LIMIT', 10000))
+app.config['MEMBER_STREAM_BATCH'] = int(os.getenv('MEMBER_STREAM_BATCH', 1000))
+app.config['MAX_MEMBER_PAGE_SIZE'] = int(os.getenv('MAX_MEMBER_PAGE_SIZE', 100000))
+app.config['ADMIN_USER_IDS'] = set(filter(None, os.getenv('ADMIN_USER_IDS', '').split(',')))
+app.config['IMPORT_CHUNK_SIZE'] = int(os.getenv('IMPORT_CHUNK_SIZE', 500))
+app.config['IMPORT_MAX_ERRORS'] = int(os.getenv('IMPORT_MAX_ERRORS', 1000))
+app.config['CACHE_BACKEND'] = os.getenv('CACHE_BACKEND', 'memory')
+app.config['CACHE_TTL'] = float(os.getenv('CACHE_TTL', 0))
+app.config['CACHE_SIZE'] = int(os.getenv('CACHE_SIZE', 1024))
+app.config['CACHE_REDIS_URL'] = os.getenv('CACHE_REDIS_URL')
 db.init_app(app)
+hasher.init_app(app)
+model_cache.init_app(app)
+replica_router.init_app(app)
+token_state.init_app(app)
+login_throttle.init_app(app)
+email_filter.init_app(app)
+request_metrics.init_app(app, db)
 migrate = Migrate(app, db)
-jwt = JWTManager(app)
+jwt = CachingJWTManager(app)
 
 @jwt.unauthorized_loader
 def unauthorized_callback(error):
@@ -28,6 +102,68 @@ def unauthorized_callback(error):
 def invalid_token_callback(error):
     return jsonify({'message': 'Invalid JWT token'}), 401
 
+@jwt.user_lookup_loader
+def user_lookup_callback(_jwt_header, jwt_data):
+    # Stateless mode trusts the signed identity instead of confirming the user row exists
+    if app.config['JWT_STATELESS']:
+        return TokenIdentity(jwt_data, app.config['JWT_IDENTITY_CLAIM'])
+    return model_cache.get_user(jwt_data[app.config['JWT_IDENTITY_CLAIM']])
+
+@jwt.token_in_blocklist_loader
+def token_revoked_check(_jwt_header, jwt_data):
+    if not tracks_token_versions():
+        return False
+    return token_state.is_revoked(jwt_data, app.config['JWT_IDENTITY_CLAIM'])
+
+@jwt.revoked_token_loader
+def revoked_token_callback(_jwt_header, jwt_data):
+    return jsonify({'message': 'Token has been revoked'}), 401
+
+def tracks_token_versions():
+    # Only tokens issued in these modes carry the ver/mver claims the token_version counters are checked against
+    return app.config['JWT_STATELESS'] or app.config['JWT_ORG_CLAIMS']
+
+def issue_access_token(user_id):
+    if app.config['JWT_ORG_CLAIMS']:
+        claims = token_state.membership_claims(user_id, app.config['JWT_ORG_CLAIM_LIMIT'])
+        return create_access_token(identity=user_id, additional_claims=claims)
+    if app.config['JWT_STATELESS']:
+        return create_access_token(identity=user_id, additional_claims=token_state.claims(user_id))
+    return create_access_token(identity=user_id)
+
+def caller_is_member(user, org_id):
+    if app.config['JWT_ORG_CLAIMS']:
+        claimed = token_state.claimed_membership(get_jwt(), org_id, app.config['JWT_IDENTITY_CLAIM'])
+        if claimed is not None:
+            return claimed
+    return Membership.is_member(user.userId, org_id)
+
+@jwt.user_lookup_error_loader
+def user_lookup_error_callback(_jwt_header, jwt_data):
+    if request.endpoint in ('get_user', 'get_users'):
+        return jsonify({'message': 'Current user not found'}), 404
+    return jsonify({'message': 'User not found'}), 404
+
+@app.errorhandler(HashingBusy)
+def hashing_busy_callback(error):
+    response = jsonify({
+        "status": "Service unavailable",
+        "message": "Server is busy, please retry",
+        "statusCode": 503
+    })
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
+@app.errorhandler(RateLimited)
+def rate_limited_callback(error):
+    response = jsonify({
+        "status": "Too many requests",
+        "message": "Too many login attempts",
+        "statusCode": 429
+    })
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
+
 @app.route('/')
 def home():
     return 'Hiiiii'
@@ -39,24 +175,23 @@ def register_user():
         validated_data = Validate.validate_user(data)
         if isinstance(validated_data, tuple):
             return validated_data
-        validated_data['password'] = generate_password_hash(validated_data['password'])
+        # Turn away known emails before paying for a password hash
+        if email_filter.enabled and email_filter.might_contain(validated_data['email']) \
+                and Validate.email_registered(validated_data['email']):
+            raise BadRequest('Email already registered')
+        validated_data['password'] = hasher.generate(validated_data['password'])
         validated_data['userId'] = str(uuid.uuid4())
         user = Validate.save_user(validated_data)
+        replica_router.mark_write(user.userId)
 
-        access_token = create_access_token(identity=user.userId)
+        access_token = issue_access_token(user.userId)
 
         response = {
             "status": "success",
             "message": "Registration successful",
             "data": {
                 "accessToken": access_token,
-                "user": {
-                    "userId": user.userId,
-                    "firstName": user.firstName,
-                    "lastName": user.lastName,
-                    "email": user.email,
-                    "phone": user.phone
-                }
+                "user": user_to_dict(user)
             }
         }
 
@@ -72,34 +207,109 @@ def register_user():
 @app.route('/auth/login', methods=['POST'])
 def login_user():
     data = request.get_json()
-    if not data or not data.get('email') or not data.get('password'):
+    if (not data or not data.get('email') or not data.get('password')
+            or not isinstance(data['email'], str) or not isinstance(data['password'], str)):
          response = {
             "status": "Bad request",
             "message": "Authentication failed",
             "statusCode": 401
         }
          return jsonify(response), 401
-    user = User.query.filter_by(email=data['email']).first()
-    if not user or not check_password_hash(user.password, data['password']):
+    login_throttle.check(request.remote_addr, data['email'])
+    user = None
+    if email_filter.might_contain(data['email'], authoritative=True):
+        user = User.query.filter_by(email=data['email']).first()
+    if user is None:
+        # Take as long as a wrong password so response time does not reveal unknown emails
+        hasher.check_dummy(data['password'])
+    if not user or not hasher.check(user.password, data['password']):
         response = {
             "status": "Bad request",
             "message": "Authentication failed",
             "statusCode": 401
         }
         return jsonify(response), 401
-    access_token = create_access_token(identity=user.userId)
+
+    # Upgrade hashes written under an older method or cost now that we have the plaintext
+    if hasher.needs_rehash(user.password):
+        try:
+            user.password = hasher.generate(data['password'])
+            db.session.commit()
+            model_cache.invalidate_user(user.userId)
+        except HashingBusy:
+            pass
+        except Exception:
+            db.session.rollback()
+
+    access_token = issue_access_token(user.userId)
     response = {
         "status": "success",
         "message": "Login successful",
         "data": {
             "accessToken": access_token,
-            "user": {
-                "userId": user.userId,
-                "firstName": user.firstName,
-                "lastName": user.lastName,
-                "email": user.email,
-                "phone": user.phone
+            "user": user_to_dict(user)
+        }
+    }
+    return jsonify(response), 200
+
+@app.route('/auth/logout', methods=['POST'])
+@jwt_required()
+def logout_user():
+    # Revokes every token issued to the caller so far. Without JWT_STATELESS or JWT_ORG_CLAIMS
+    # tokens are not checked against token_version and stay valid until they expire.
+    user = get_current_user()
+    if tracks_token_versions():
+        try:
+            token_state.revoke(user.userId)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            response = {
+                "status": "Bad request",
+                "message": "Logout unsuccessful",
+                "statusCode": 400
             }
+            return jsonify(response), 400
+
+    response = {
+        "status": "success",
+        "message": "Logout successful"
+    }
+    return jsonify(response), 200
+
+@app.route('/api/users', methods=['GET'])
+@jwt_required()
+def get_users():
+    current_user = get_current_user()
+
+    # ?ids=a,b,c and ?ids=a&ids=b both work; duplicates collapse, first position wins
+    user_ids = list(dict.fromkeys(
+        user_id.strip() for value in request.args.getlist('ids') for user_id in value.split(',') if user_id.strip()
+    ))
+    if not user_ids or len(user_ids) > app.config['MAX_BATCH_USERS']:
+        response = {
+            "status": "Bad request",
+            "message": "Client error",
+            "statusCode": 400
+        }
+        return jsonify(response), 400
+
+    found = Membership.visible_users(current_user.userId, user_ids)
+    results = []
+    for user_id in user_ids:
+        row = found.get(user_id)
+        if row is None:
+            results.append({"userId": user_id, "status": "missing"})
+        elif not row.visible:
+            results.append({"userId": user_id, "status": "forbidden"})
+        else:
+            results.append({"userId": user_id, "status": "found", "user": user_to_dict(row)})
+
+    response = {
+        "status": "success",
+        "message": "Users retrieved successfully",
+        "data": {
+            "users": results
         }
     }
     return jsonify(response), 200
@@ -107,55 +317,92 @@ def login_user():
 @app.route('/api/users/<id>', methods=['GET'])
 @jwt_required()
 def get_user(id):
-    current_user_id = get_jwt_identity()
-    current_user = User.query.filter_by(userId=current_user_id).first()
+    current_user = get_current_user()
 
-    if not current_user:
-        return jsonify({'message': 'Current user not found'}), 404
-
-    user = User.query.filter_by(userId=id).first()
+    if id == current_user.userId and isinstance(current_user, User):
+        user = current_user
+    else:
+        user = model_cache.get_user(id)
 
     if not user:
         return jsonify({'message': 'User not found'}), 404
 
-    shared_organisations = set(current_user.organisations).intersection(user.organisations)
-    if not shared_organisations and user != current_user:
+    if user.userId != current_user.userId and not Membership.shares_organisation(current_user.userId, user.userId):
         return jsonify({'message': 'You do not have permission to view this user'}), 403
 
+    etag = resource_etag('user', user.userId, user.version)
+    unchanged = not_modified(etag)
+    if unchanged:
+        return unchanged
+
     response = {
         "status": "success",
         "message": "User retrieved successfully",
-        "data": {
-            "userId": user.userId,
-            "firstName": user.firstName,
-            "lastName": user.lastName,
-            "email": user.email,
-            "phone": user.phone
-        }
+        "data": user_to_dict(user)
     }
-    return jsonify(response), 200
+    return tagged(jsonify(response), etag), 200
 
 @app.route('/api/organisations', methods=['GET'])
 @jwt_required()
 def get_organisations():
-    user_id = get_jwt_identity()
-    user = User.query.filter_by(userId=user_id).first()
+    user = get_current_user()
 
-    if not user:
-        return jsonify({'message': 'User not found'}), 404
+    try:
+        limit = parse_limit(request.args.get('limit'), app.config['PAGE_SIZE'], app.config['MAX_PAGE_SIZE'])
+        after = decode_cursor(request.args.get('cursor'))
+    except ValueError:
+        response = {
+            "status": "Bad request",
+            "message": "Client error",
+            "statusCode": 400
+        }
+        return jsonify(response), 400
+
+    rows = Membership.organisations_page(user.userId, after=after, limit=limit)
+    # The lookahead row is hashed too, so a change in nextCursor changes the tag
+    etag = collection_etag(limit, rows=rows)
+    unchanged = not_modified(etag)
+    if unchanged:
+        return unchanged
+
+    organisations, next_cursor = keyset_page(rows, limit, key=lambda org: org.orgId)
+    organisation_list = [organisation_to_dict(org) for org in organisations]
+
+    response = {
+        "status": "success",
+        "message": "Organisations retrieved successfully",
+        "data": {
+            "organisations": organisation_list,
+            "nextCursor": next_cursor
+        }
+    }
+    return tagged(jsonify(response), etag), 200
+
+@app.route('/api/organisations/search', methods=['GET'])
+@jwt_required()
+def search_organisations():
+    user = get_current_user()
 
-    organisations = user.organisations
-    organisation_list = [{
-        "orgId": org.orgId,
-        "name": org.name,
-        "description": org.description
-    } for org in organisations]
+    q = (request.args.get('q') or '').strip()
+    try:
+        limit = parse_limit(request.args.get('limit'), app.config['SEARCH_LIMIT'], app.config['MAX_PAGE_SIZE'])
+        if not q or len(q) > 120:
+            raise ValueError('q must be 1 to 120 characters')
+    except ValueError:
+        response = {
+            "status": "Bad request",
+            "message": "Client error",
+            "statusCode": 400
+        }
+        return jsonify(response), 400
 
+    rows = OrganisationSearch.search(user.userId, q, limit=limit, threshold=app.config['SEARCH_THRESHOLD'],
+                                     scan_limit=app.config['SEARCH_SCAN_LIMIT'])
     response = {
         "status": "success",
         "message": "Organisations retrieved successfully",
         "data": {
-            "organisations": organisation_list
+            "organisations": [organisation_to_dict(org) for org in rows]
         }
     }
     return jsonify(response), 200
@@ -163,40 +410,33 @@ def get_organisations():
 @app.route('/api/organisations/<orgId>', methods=['GET'])
 @jwt_required()
 def get_organisation(orgId):
-    user_id = get_jwt_identity()
-    user = User.query.filter_by(userId=user_id).first()
-
-    if not user:
-        return jsonify({'message': 'User not found'}), 404
+    user = get_current_user()
 
-    organisation = Organisation.query.filter_by(orgId=orgId).first()
+    organisation = model_cache.get_organisation(orgId)
 
     if not organisation:
         return jsonify({'message': 'Organisation not found'}), 404
 
     # Check if the logged-in user belongs to the organisation
-    if user not in organisation.users:
+    if not caller_is_member(user, organisation.orgId):
         return jsonify({'message': 'You do not have permission to view this organisation'}), 403
 
+    etag = resource_etag('organisation', organisation.orgId, organisation.version)
+    unchanged = not_modified(etag)
+    if unchanged:
+        return unchanged
+
     response = {
         "status": "success",
         "message": "Organisation retrieved successfully",
-        "data": {
-            "orgId": organisation.orgId,
-            "name": organisation.name,
-            "description": organisation.description
-        }
+        "data": organisation_to_dict(organisation)
     }
-    return jsonify(response), 200
+    return tagged(jsonify(response), etag), 200
 
 @app.route('/api/organisations', methods=['POST'])
 @jwt_required()
 def create_organisation():
-    user_id = get_jwt_identity()
-    user = User.query.filter_by(userId=user_id).first()
-
-    if not user:
-        return jsonify({'message': 'User not found'}), 404
+    user = get_current_user()
 
     data = request.get_json()
     if not data or not data.get('name'):
@@ -211,11 +451,18 @@ def create_organisation():
     description = data.get('description', '')
 
     organisation = Organisation(name=name, description=description)
-    organisation.users.append(user)
 
     try:
         db.session.add(organisation)
+        db.session.flush()
+        Membership.add(user.userId, organisation.orgId)
+        Membership.touch(None, [user.userId])
+        if tracks_token_versions():
+            token_state.memberships_changed([user.userId])
+        user_id = user.userId
         db.session.commit()
+        model_cache.invalidate_user(user_id)
+        model_cache.invalidate_organisation(organisation.orgId)
     except Exception as e:
         db.session.rollback()
         response = {
@@ -228,24 +475,68 @@ def create_organisation():
     response = {
         "status": "success",
         "message": "Organisation created successfully",
-        "data": {
-            "orgId": organisation.orgId,
-            "name": organisation.name,
-            "description": organisation.description
-        }
+        "data": organisation_to_dict(organisation)
     }
     return jsonify(response), 201
 
+@app.route('/api/organisations/<orgId>/users', methods=['GET'])
+@jwt_required()
+def get_organisation_users(orgId):
+    """Stream members as a JSON array or NDJSON (``?format=ndjson`` or Accept: application/x-ndjson).
+
+    Rows come off a server-side cursor ``MEMBER_STREAM_BATCH`` at a time, so
+    memory stays flat however large the organisation. Without ``limit`` every
+    member is sent; with it the body ends with the cursor for the next page.
+    """
+    user = get_current_user()
+
+    fmt = request.args.get('format')
+    if fmt is None:
+        best = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+        fmt = 'ndjson' if best == 'application/x-ndjson' else 'json'
+    try:
+        limit = parse_limit(request.args.get('limit'), None, app.config['MAX_MEMBER_PAGE_SIZE'])
+        after = decode_cursor(request.args.get('cursor'))
+        if fmt not in ('json', 'ndjson'):
+            raise ValueError(f'Unknown format {fmt}')
+    except ValueError:
+        response = {
+            "status": "Bad request",
+            "message": "Client error",
+            "statusCode": 400
+        }
+        return jsonify(response), 400
+
+    organisation = model_cache.get_organisation(orgId)
+    if not organisation:
+        return jsonify({'message': 'Organisation not found'}), 404
+
+    if not caller_is_member(user, orgId):
+        return jsonify({'message': 'You do not have permission to view this organisation'}), 403
+
+    query = Membership.members_query(orgId, after=after, limit=limit)
+    result = db.session.execute(query.execution_options(yield_per=app.config['MEMBER_STREAM_BATCH']))
+    stream = KeysetStream(result, limit, key=lambda row: row.userId)
+    if fmt == 'ndjson':
+        body, mimetype = ndjson_body(stream, user_to_dict), 'application/x-ndjson'
+    else:
+        envelope = {"status": "success", "message": "Members retrieved successfully"}
+        body, mimetype = json_body(stream, user_to_dict, envelope, 'users'), 'application/json'
+
+    headers = {'Vary': 'Accept-Encoding'}
+    if request.accept_encodings['gzip']:
+        body = gzip_body(body)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+
 @app.route('/api/organisations/<orgId>/users', methods=['POST'])
 @jwt_required()
 def add_user_to_organisation(orgId):
-    user_id = get_jwt_identity()
-    user = User.query.filter_by(userId=user_id).first()
-
-    if not user:
-        return jsonify({'message': 'User not found'}), 404
+    user = get_current_user()
 
     data = request.get_json()
+    if data and 'userIds' in data:
+        return add_users_to_organisation(orgId, user, data['userIds'])
     if not data or not data.get('userId'):
         response = {
             "status": "Bad request",
@@ -254,7 +545,7 @@ def add_user_to_organisation(orgId):
         }
         return jsonify(response), 400
 
-    target_user = User.query.filter_by(userId=data['userId']).first()
+    target_user = model_cache.get_user(data['userId'])
     if not target_user:
         response = {
             "status": "Bad request",
@@ -263,7 +554,7 @@ def add_user_to_organisation(orgId):
         }
         return jsonify(response), 404
 
-    organisation = Organisation.query.filter_by(orgId=orgId).first()
+    organisation = model_cache.get_organisation(orgId)
     if not organisation:
         response = {
             "status": "Bad request",
@@ -273,12 +564,18 @@ def add_user_to_organisation(orgId):
         return jsonify(response), 404
 
     # Check if the logged-in user belongs to the organisation
-    if user not in organisation.users:
+    if not caller_is_member(user, organisation.orgId):
         return jsonify({'message': 'You do not have permission to add users to this organisation'}), 403
 
-    organisation.users.append(target_user)
     try:
+        Membership.add(target_user.userId, organisation.orgId)
+        Membership.touch(organisation.orgId, [target_user.userId])
+        if tracks_token_versions():
+            token_state.memberships_changed([target_user.userId])
         db.session.commit()
+        # Keys from the request, as the committed instances are expired
+        model_cache.invalidate_user(data['userId'])
+        model_cache.invalidate_organisation(orgId)
     except Exception as e:
         db.session.rollback()       
         response = {
@@ -294,6 +591,110 @@ def add_user_to_organisation(orgId):
     }
     return jsonify(response), 200
 
+def add_users_to_organisation(orgId, user, user_ids):
+    if (not isinstance(user_ids, list) or not user_ids or len(user_ids) > app.config['MAX_BULK_MEMBERS']
+            or not all(isinstance(user_id, str) and user_id for user_id in user_ids)):
+        response = {
+            "status": "Bad request",
+            "message": "Client error",
+            "statusCode": 400
+        }
+        return jsonify(response), 400
+
+    organisation = model_cache.get_organisation(orgId)
+    if not organisation:
+        response = {
+            "status": "Bad request",
+            "message": "Organisation not found",
+            "statusCode": 404
+        }
+        return jsonify(response), 404
+
+    if not caller_is_member(user, organisation.orgId):
+        return jsonify({'message': 'You do not have permission to add users to this organisation'}), 403
+
+    try:
+        results = Membership.add_many(organisation.orgId, user_ids)
+        added = [user_id for user_id, status in results.items() if status == 'added']
+        if added:
+            Membership.touch(organisation.orgId, added)
+            if tracks_token_versions():
+                token_state.memberships_changed(added)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        response = {
+            "status": "Bad request",
+            "message": "Client error",
+            "statusCode": 400
+        }
+        return jsonify(response), 400
+
+    for user_id in added:
+        model_cache.invalidate_user(user_id)
+    model_cache.invalidate_organisation(organisation.orgId)
+
+    response = {
+        "status": "success",
+        "message": "Users added to organisation successfully",
+        "data": {
+            "results": [{"userId": user_id, "status": status} for user_id, status in results.items()]
+        }
+    }
+    return jsonify(response), 200
+
+@app.route('/admin/users/import', methods=['POST'])
+@jwt_required()
+def import_users():
+    user = get_current_user()
+    if user.userId not in app.config['ADMIN_USER_IDS']:
+        return jsonify({'message': 'You do not have permission to import users'}), 403
+
+    fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+    if fmt not in ('csv', 'ndjson'):
+        response = {
+            "status": "Bad request",
+            "message": "Client error",
+            "statusCode": 400
+        }
+        return jsonify(response), 400
+
+    errors = []
+
+    def on_error(row_number, row_errors):
+        if len(errors) < app.config['IMPORT_MAX_ERRORS']:
+            errors.append({'row': row_number, 'errors': row_errors})
+
+    importer = UserImporter(chunk_size=app.config['IMPORT_CHUNK_SIZE'], on_error=on_error)
+    report = importer.run(iter_records(request.stream, fmt))
+    response = {
+        "status": "success",
+        "message": "Users imported",
+        "data": dict(report, errors=errors)
+    }
+    return jsonify(response), 200
+
+@app.cli.command('import-users')
+@click.argument('source', type=click.File('rb'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default=None,
+              help='Input format; guessed from the file extension when omitted.')
+@click.option('--chunk-size', type=int, default=None, help='Rows validated and inserted per transaction.')
+def import_users_command(source, fmt, chunk_size):
+    """Stream users from an NDJSON or CSV file (or stdin) into the database."""
+    if fmt is None:
+        fmt = 'csv' if source.name.endswith('.csv') else 'ndjson'
+
+    def on_error(row_number, row_errors):
+        messages = '; '.join(error['message'] for error in row_errors)
+        click.echo(f'row {row_number}: {messages}', err=True)
+
+    importer = UserImporter(chunk_size=chunk_size or app.config['IMPORT_CHUNK_SIZE'], on_error=on_error)
+    report = importer.run(iter_records(source, fmt))
+    click.echo(f"imported {report['imported']} users, {report['failed']} failed "
+               f"in {report['seconds']}s ({report['rowsPerSecond']} rows/s)")
+    if report['failed']:
+        sys.exit(1)
+
 
 if __name__ == '__main__':
     with app.app_context():
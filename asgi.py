@@ -0,0 +1,615 @@
+"""Async serving mode: the /auth/* and /api/* routes on an ASGI app and an async engine.
+
+    uvicorn asgi:application --workers 4
+
+Configuration, JWT settings and password hashing are shared with the Flask
+app in app.py, so tokens issued by either app are accepted by the other and
+responses have the same shape, ETags included. The admin import endpoint and
+/metrics are only served by the Flask app. ``ASYNC_DATABASE_URI`` overrides the driver
+URL derived from ``DATABASE_URI`` (asyncpg for PostgreSQL, aiosqlite for SQLite).
+"""
+import asyncio
+import os
+import uuid
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+from flask_jwt_extended import create_access_token, decode_token
+from jwt.exceptions import ExpiredSignatureError, PyJWTError
+from flask_jwt_extended.exceptions import JWTExtendedException
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+
+from app import app as flask_app, tracks_token_versions
+from models import User, Organisation, TokenVersion, user_organisation
+from membership import Membership
+from validate import Validate
+from hashing import hasher, HashingBusy
+from pagination import decode_cursor, parse_limit, keyset_page
+from pooling import engine_options
+from tokens import token_state
+from cache import model_cache
+from emailfilter import email_filter
+from ratelimit import login_throttle, RateLimited
+from serializers import dumps_bytes, user_to_dict, organisation_to_dict
+from etags import resource_etag, collection_etag
+from search import OrganisationSearch
+from streaming import AsyncKeysetStream, NDJSONBody, JSONBody, async_body, async_gzip_body
+
+
+def async_uri(uri):
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    for sync, driver in (('postgresql+psycopg2://', 'postgresql+asyncpg://'),
+                         ('postgresql://', 'postgresql+asyncpg://'),
+                         ('sqlite://', 'sqlite+aiosqlite://')):
+        if uri.startswith(sync):
+            return driver + uri[len(sync):]
+    return uri
+
+
+def async_engine_options(uri):
+    options = engine_options(uri)
+    # psycopg2 keepalive arguments do not apply to asyncpg
+    options.pop('connect_args', None)
+    if uri.startswith('sqlite') and (':memory:' in uri or uri.rstrip('/').endswith('sqlite:')):
+        options['poolclass'] = StaticPool
+    return options
+
+
+DATABASE_URI = os.getenv('ASYNC_DATABASE_URI') or async_uri(flask_app.config['SQLALCHEMY_DATABASE_URI'])
+engine = create_async_engine(DATABASE_URI, **async_engine_options(DATABASE_URI))
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+
+class FastJSONResponse(JSONResponse):
+
+    def render(self, content):
+        return dumps_bytes(content)
+
+
+def client_error(message='Client error', status_code=400):
+    return FastJSONResponse({
+        "status": "Bad request",
+        "message": message,
+        "statusCode": status_code
+    }, status_code=status_code)
+
+
+async def token_versions(session, user_id):
+    state = token_state.cache.get(user_id)
+    if state is None:
+        row = (await session.execute(
+            select(TokenVersion.version, TokenVersion.membership_version).where(TokenVersion.user_id == user_id)
+        )).first()
+        state = tuple(row) if row else (0, 0)
+        token_state.cache.set(user_id, state)
+    return state
+
+
+async def issue_token(session, user_id):
+    claims = {}
+    if flask_app.config['JWT_STATELESS'] or flask_app.config['JWT_ORG_CLAIMS']:
+        version, membership_version = await token_versions(session, user_id)
+        claims = {'ver': version, 'mver': membership_version}
+    if flask_app.config['JWT_ORG_CLAIMS']:
+        limit = flask_app.config['JWT_ORG_CLAIM_LIMIT']
+        claims.update(token_state.org_claims(await session.scalars(token_state.org_ids_query(user_id, limit)), limit))
+    with flask_app.app_context():
+        return create_access_token(identity=user_id, additional_claims=claims)
+
+
+async def run_hasher(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+def email_might_exist(email):
+    # Blocking (redis, or the initial load through Flask-SQLAlchemy), so callers run it in an executor
+    with flask_app.app_context():
+        return email_filter.might_contain(email, authoritative=True)
+
+
+async def invalidate_cached(user_ids=(), org_ids=()):
+    """Drop the Flask app's cached users and organisations after a commit, off the loop as the redis backend blocks."""
+    def invalidate():
+        for user_id in user_ids:
+            model_cache.invalidate_user(user_id)
+        for org_id in org_ids:
+            model_cache.invalidate_organisation(org_id)
+    await asyncio.get_running_loop().run_in_executor(None, invalidate)
+
+
+async def bump_token_versions(session, column, user_ids):
+    """Async counterpart of ``TokenState._bump``; the caller commits."""
+    await session.execute(token_state.bump_statement(column, user_ids))
+    existing = set(await session.scalars(token_state.existing_query(user_ids)))
+    rows = token_state.missing_rows(column, user_ids, existing)
+    if rows:
+        await session.execute(insert(TokenVersion), rows)
+    for user_id in user_ids:
+        token_state.cache.delete(user_id)
+
+
+async def memberships_changed(session, org_id, user_ids):
+    """Async counterpart of ``Membership.touch`` plus ``token_state.memberships_changed``; the caller commits."""
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return
+    for statement in Membership.touch_statements(org_id, user_ids):
+        await session.execute(statement)
+    if tracks_token_versions():
+        await bump_token_versions(session, TokenVersion.membership_version, user_ids)
+
+
+def not_modified(request, etag):
+    """A bodiless 304 when If-None-Match already names ``etag``, otherwise None; see etags.not_modified."""
+    if not parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+        return None
+    return Response(status_code=304, headers={'ETag': quote_etag(etag)})
+
+
+def tagged(response, etag):
+    response.headers['ETag'] = quote_etag(etag)
+    return response
+
+
+async def read_json(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def authenticate(request, session, missing_message='User not found'):
+    """Return ``(user, None)`` for a valid bearer token, else ``(None, error_response)``."""
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None, FastJSONResponse({'message': 'Missing JWT token'}, status_code=401)
+    try:
+        with flask_app.app_context():
+            claims = decode_token(header[len('Bearer '):])
+    except ExpiredSignatureError:
+        return None, FastJSONResponse({'msg': 'Token has expired'}, status_code=401)
+    except (PyJWTError, JWTExtendedException):
+        return None, FastJSONResponse({'message': 'Invalid JWT token'}, status_code=401)
+    user_id = claims[flask_app.config['JWT_IDENTITY_CLAIM']]
+    if tracks_token_versions() and claims.get('ver', 0) < (await token_versions(session, user_id))[0]:
+        return None, FastJSONResponse({'message': 'Token has been revoked'}, status_code=401)
+    user = await session.get(User, user_id)
+    if user is None:
+        return None, FastJSONResponse({'message': missing_message}, status_code=404)
+    return user, None
+
+
+async def register_user(request):
+    data = await read_json(request) or {}
+    errors = Validate.user_errors(data)
+    if errors:
+        return FastJSONResponse({'errors': errors}, status_code=422)
+    try:
+        password = await run_hasher(hasher.generate, data['password'])
+    except HashingBusy as e:
+        return hashing_busy(e)
+
+    user = User(
+        userId=str(uuid.uuid4()),
+        firstName=data['firstName'],
+        lastName=data['lastName'],
+        email=data['email'],
+        password=password,
+        phone=data.get('phone')
+    )
+    organisation = Organisation(**Validate.default_organisation(user.firstName, user.lastName))
+    async with Session() as session:
+        try:
+            session.add_all([user, organisation])
+            await session.flush()
+            await session.execute(user_organisation.insert().values(user_id=user.userId, organisation_id=organisation.orgId))
+            await session.commit()
+        except IntegrityError:
+            await session.rollback()
+            return client_error('Registration unsuccessful')
+        email_filter.add(user.email)
+        access_token = await issue_token(session, user.userId)
+
+    return FastJSONResponse({
+        "status": "success",
+        "message": "Registration successful",
+        "data": {
+            "accessToken": access_token,
+            "user": user_to_dict(user)
+        }
+    }, status_code=201)
+
+
+async def login_user(request):
+    data = await read_json(request)
+    if (not data or not data.get('email') or not data.get('password')
+            or not isinstance(data['email'], str) or not isinstance(data['password'], str)):
+        return client_error('Authentication failed', 401)
+    try:
+        login_throttle.check(request.client.host if request.client else None, data['email'])
+    except RateLimited as e:
+        return rate_limited(e)
+    async with Session() as session:
+        user = None
+        if await asyncio.get_running_loop().run_in_executor(None, email_might_exist, data['email']):
+            user = (await session.execute(select(User).where(User.email == data['email']))).scalars().first()
+        try:
+            if user is None:
+                # Take as long as a wrong password so response time does not reveal unknown emails
+                await run_hasher(hasher.check_dummy, data['password'])
+                return client_error('Authentication failed', 401)
+            valid = await run_hasher(hasher.check, user.password, data['password'])
+        except HashingBusy as e:
+            return hashing_busy(e)
+        if not valid:
+            return client_error('Authentication failed', 401)
+        # Read before the rehash, as a rollback there expires the instance
+        user_id, profile = user.userId, user_to_dict(user)
+
+        # Upgrade hashes written under an older method or cost now that we have the plaintext
+        if hasher.needs_rehash(user.password):
+            try:
+                user.password = await run_hasher(hasher.generate, data['password'])
+                await session.commit()
+                await invalidate_cached(user_ids=[user_id])
+            except HashingBusy:
+                pass
+            except Exception:
+                await session.rollback()
+        access_token = await issue_token(session, user_id)
+
+    return FastJSONResponse({
+        "status": "success",
+        "message": "Login successful",
+        "data": {
+            "accessToken": access_token,
+            "user": profile
+        }
+    })
+
+
+async def logout_user(request):
+    async with Session() as session:
+        user, error = await authenticate(request, session)
+        if error:
+            return error
+        # See the Flask view: tokens are only checked against token_version in these modes
+        if tracks_token_versions():
+            try:
+                await bump_token_versions(session, TokenVersion.version, [user.userId])
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                return client_error('Logout unsuccessful')
+
+    return FastJSONResponse({
+        "status": "success",
+        "message": "Logout successful"
+    })
+
+
+async def get_user(request):
+    async with Session() as session:
+        current_user, error = await authenticate(request, session, 'Current user not found')
+        if error:
+            return error
+        user_id = request.path_params['id']
+        user = current_user if user_id == current_user.userId else await session.get(User, user_id)
+        if not user:
+            return FastJSONResponse({'message': 'User not found'}, status_code=404)
+        if user is not current_user and not (await session.execute(
+                Membership.shares_organisation_query(current_user.userId, user.userId))).scalar():
+            return FastJSONResponse({'message': 'You do not have permission to view this user'}, status_code=403)
+
+    etag = resource_etag('user', user.userId, user.version)
+    unchanged = not_modified(request, etag)
+    if unchanged:
+        return unchanged
+    return tagged(FastJSONResponse({
+        "status": "success",
+        "message": "User retrieved successfully",
+        "data": user_to_dict(user)
+    }), etag)
+
+
+async def get_users(request):
+    # ?ids=a,b,c and ?ids=a&ids=b both work; duplicates collapse, first position wins
+    user_ids = list(dict.fromkeys(
+        user_id.strip() for value in request.query_params.getlist('ids') for user_id in value.split(',') if user_id.strip()
+    ))
+    async with Session() as session:
+        current_user, error = await authenticate(request, session, 'Current user not found')
+        if error:
+            return error
+        if not user_ids or len(user_ids) > flask_app.config['MAX_BATCH_USERS']:
+            return client_error()
+        rows = await session.execute(Membership.visible_users_query(current_user.userId, user_ids))
+        found = {row.userId: row for row in rows}
+
+    results = []
+    for user_id in user_ids:
+        row = found.get(user_id)
+        if row is None:
+            results.append({"userId": user_id, "status": "missing"})
+        elif not row.visible:
+            results.append({"userId": user_id, "status": "forbidden"})
+        else:
+            results.append({"userId": user_id, "status": "found", "user": user_to_dict(row)})
+    return FastJSONResponse({
+        "status": "success",
+        "message": "Users retrieved successfully",
+        "data": {
+            "users": results
+        }
+    })
+
+
+async def get_organisations(request):
+    try:
+        limit = parse_limit(request.query_params.get('limit'), flask_app.config['PAGE_SIZE'], flask_app.config['MAX_PAGE_SIZE'])
+        after = decode_cursor(request.query_params.get('cursor'))
+    except ValueError:
+        return client_error()
+    async with Session() as session:
+        user, error = await authenticate(request, session)
+        if error:
+            return error
+        rows = (await session.execute(Membership.organisations_page_query(user.userId, after, limit))).all()
+
+    etag = collection_etag(limit, rows=rows)
+    unchanged = not_modified(request, etag)
+    if unchanged:
+        return unchanged
+    organisations, next_cursor = keyset_page(rows, limit, key=lambda org: org.orgId)
+    return tagged(FastJSONResponse({
+        "status": "success",
+        "message": "Organisations retrieved successfully",
+        "data": {
+            "organisations": [organisation_to_dict(org) for org in organisations],
+            "nextCursor": next_cursor
+        }
+    }), etag)
+
+
+async def search_rows(session, user_id, q, limit, threshold, scan_limit):
+    """``OrganisationSearch.search`` on an async session."""
+    if len(q) < 3:
+        return (await session.execute(OrganisationSearch.prefix_query(user_id, q, limit))).all()
+    if engine.dialect.name == 'postgresql':
+        await session.execute(OrganisationSearch.threshold_statement(threshold))
+        return (await session.execute(OrganisationSearch.postgresql_query(user_id, q, limit))).all()
+    if engine.dialect.name == 'sqlite' and \
+            (await session.execute(OrganisationSearch.membership_count_query(user_id))).scalar() > scan_limit:
+        rows = await session.execute(OrganisationSearch.sqlite_query(user_id, q))
+    else:
+        rows = await session.execute(OrganisationSearch.scoped_query(user_id))
+    return OrganisationSearch.rank(q, rows, limit, threshold)
+
+
+async def search_organisations(request):
+    q = (request.query_params.get('q') or '').strip()
+    try:
+        limit = parse_limit(request.query_params.get('limit'), flask_app.config['SEARCH_LIMIT'], flask_app.config['MAX_PAGE_SIZE'])
+        if not q or len(q) > 120:
+            raise ValueError('q must be 1 to 120 characters')
+    except ValueError:
+        return client_error()
+    async with Session() as session:
+        user, error = await authenticate(request, session)
+        if error:
+            return error
+        rows = await search_rows(session, user.userId, q, limit, flask_app.config['SEARCH_THRESHOLD'],
+                                 flask_app.config['SEARCH_SCAN_LIMIT'])
+
+    return FastJSONResponse({
+        "status": "success",
+        "message": "Organisations retrieved successfully",
+        "data": {
+            "organisations": [organisation_to_dict(org) for org in rows]
+        }
+    })
+
+
+async def get_organisation(request):
+    async with Session() as session:
+        user, error = await authenticate(request, session)
+        if error:
+            return error
+        organisation = await session.get(Organisation, request.path_params['orgId'])
+        if not organisation:
+            return FastJSONResponse({'message': 'Organisation not found'}, status_code=404)
+        if not (await session.execute(Membership.is_member_query(user.userId, organisation.orgId))).scalar():
+            return FastJSONResponse({'message': 'You do not have permission to view this organisation'}, status_code=403)
+
+    etag = resource_etag('organisation', organisation.orgId, organisation.version)
+    unchanged = not_modified(request, etag)
+    if unchanged:
+        return unchanged
+    return tagged(FastJSONResponse({
+        "status": "success",
+        "message": "Organisation retrieved successfully",
+        "data": organisation_to_dict(organisation)
+    }), etag)
+
+
+async def member_rows(query, fmt, limit):
+    """Stream ``query`` on a session of its own, which stays open until the body is sent."""
+    async with Session() as session:
+        result = await session.stream(query.execution_options(yield_per=flask_app.config['MEMBER_STREAM_BATCH']))
+        stream = AsyncKeysetStream(result, limit, key=lambda row: row.userId)
+        async for chunk in async_body(stream, fmt):
+            yield chunk
+
+
+async def get_organisation_users(request):
+    """Members as a JSON array or NDJSON; see ``get_organisation_users`` in app.py."""
+    org_id = request.path_params['orgId']
+    fmt = request.query_params.get('format')
+    if fmt is None:
+        accept = parse_accept_header(request.headers.get('accept'), MIMEAccept)
+        best = accept.best_match(['application/json', 'application/x-ndjson'])
+        fmt = 'ndjson' if best == 'application/x-ndjson' else 'json'
+    try:
+        limit = parse_limit(request.query_params.get('limit'), None, flask_app.config['MAX_MEMBER_PAGE_SIZE'])
+        after = decode_cursor(request.query_params.get('cursor'))
+        if fmt not in ('json', 'ndjson'):
+            raise ValueError(f'Unknown format {fmt}')
+    except ValueError:
+        return client_error()
+    async with Session() as session:
+        user, error = await authenticate(request, session)
+        if error:
+            return error
+        if not await session.get(Organisation, org_id):
+            return FastJSONResponse({'message': 'Organisation not found'}, status_code=404)
+        if not (await session.execute(Membership.is_member_query(user.userId, org_id))).scalar():
+            return FastJSONResponse({'message': 'You do not have permission to view this organisation'}, status_code=403)
+
+    if fmt == 'ndjson':
+        encoder, media_type = NDJSONBody(user_to_dict), 'application/x-ndjson'
+    else:
+        envelope = {"status": "success", "message": "Members retrieved successfully"}
+        encoder, media_type = JSONBody(user_to_dict, envelope, 'users'), 'application/json'
+    body = member_rows(Membership.members_query(org_id, after=after, limit=limit), encoder, limit)
+
+    headers = {'Vary': 'Accept-Encoding'}
+    if parse_accept_header(request.headers.get('accept-encoding'))['gzip']:
+        body = async_gzip_body(body)
+        headers['Content-Encoding'] = 'gzip'
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+
+async def create_organisation(request):
+    async with Session() as session:
+        user, error = await authenticate(request, session)
+        if error:
+            return error
+        data = await read_json(request)
+        if not data or not data.get('name'):
+            return client_error()
+        organisation = Organisation(orgId=str(uuid.uuid4()), name=data['name'], description=data.get('description', ''))
+        try:
+            session.add(organisation)
+            await session.flush()
+            await session.execute(user_organisation.insert().values(user_id=user.userId, organisation_id=organisation.orgId))
+            await memberships_changed(session, None, [user.userId])
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            return client_error()
+        await invalidate_cached(user_ids=[user.userId], org_ids=[organisation.orgId])
+
+    return FastJSONResponse({
+        "status": "success",
+        "message": "Organisation created successfully",
+        "data": organisation_to_dict(organisation)
+    }, status_code=201)
+
+
+async def add_user_to_organisation(request):
+    org_id = request.path_params['orgId']
+    async with Session() as session:
+        user, error = await authenticate(request, session)
+        if error:
+            return error
+        data = await read_json(request)
+        if data and 'userIds' in data:
+            return await add_users_to_organisation(session, org_id, user, data['userIds'])
+        if not data or not data.get('userId'):
+            return client_error()
+        target_user = await session.get(User, data['userId'])
+        if not target_user:
+            return client_error('User not found', 404)
+        if not await session.get(Organisation, org_id):
+            return client_error('Organisation not found', 404)
+        if not (await session.execute(Membership.is_member_query(user.userId, org_id))).scalar():
+            return FastJSONResponse({'message': 'You do not have permission to add users to this organisation'}, status_code=403)
+        try:
+            await session.execute(user_organisation.insert().values(user_id=target_user.userId, organisation_id=org_id))
+            await memberships_changed(session, org_id, [target_user.userId])
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            return client_error()
+        await invalidate_cached(user_ids=[target_user.userId], org_ids=[org_id])
+
+    return FastJSONResponse({
+        "status": "success",
+        "message": "User added to organisation successfully"
+    })
+
+
+async def add_users_to_organisation(session, org_id, user, user_ids):
+    if (not isinstance(user_ids, list) or not user_ids or len(user_ids) > flask_app.config['MAX_BULK_MEMBERS']
+            or not all(isinstance(user_id, str) and user_id for user_id in user_ids)):
+        return client_error()
+    if not await session.get(Organisation, org_id):
+        return client_error('Organisation not found', 404)
+    if not (await session.execute(Membership.is_member_query(user.userId, org_id))).scalar():
+        return FastJSONResponse({'message': 'You do not have permission to add users to this organisation'}, status_code=403)
+
+    user_ids = list(dict.fromkeys(user_ids))
+    rows = await session.execute(Membership.add_many_query(org_id, user_ids))
+    results, missing = Membership.plan_add_many(org_id, user_ids, rows)
+    added = [user_id for user_id, status in results.items() if status == 'added']
+    try:
+        for statement in Membership.insert_ignore_statements(engine.dialect.name, missing):
+            await session.execute(statement)
+        await memberships_changed(session, org_id, added)
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        return client_error()
+    await invalidate_cached(user_ids=added, org_ids=[org_id])
+
+    return FastJSONResponse({
+        "status": "success",
+        "message": "Users added to organisation successfully",
+        "data": {
+            "results": [{"userId": user_id, "status": status} for user_id, status in results.items()]
+        }
+    })
+
+
+def rate_limited(error):
+    return FastJSONResponse({
+        "status": "Too many requests",
+        "message": "Too many login attempts",
+        "statusCode": 429
+    }, status_code=429, headers={'Retry-After': str(error.retry_after)})
+
+
+def hashing_busy(error):
+    return FastJSONResponse({
+        "status": "Service unavailable",
+        "message": "Server is busy, please retry",
+        "statusCode": 503
+    }, status_code=503, headers={'Retry-After': str(error.retry_after)})
+
+
+async def home(request):
+    return PlainTextResponse('Hiiiii')
+
+
+application = Starlette(routes=[
+    Route('/', home),
+    Route('/auth/register', register_user, methods=['POST']),
+    Route('/auth/login', login_user, methods=['POST']),
+    Route('/auth/logout', logout_user, methods=['POST']),
+    Route('/api/users', get_users, methods=['GET']),
+    Route('/api/users/{id}', get_user, methods=['GET']),
+    Route('/api/organisations', get_organisations, methods=['GET']),
+    Route('/api/organisations', create_organisation, methods=['POST']),
+    Route('/api/organisations/search', search_organisations, methods=['GET']),
+    Route('/api/organisations/{orgId}', get_organisation, methods=['GET']),
+    Route('/api/organisations/{orgId}/users', get_organisation_users, methods=['GET']),
+    Route('/api/organisations/{orgId}/users', add_user_to_organisation, methods=['POST']),
+])
@@ -0,0 +1,135 @@
+"""Compare the WSGI app (app.py) with the async ASGI app (asgi.py) under concurrent load.
+
+    python benchmarks/asgi_vs_wsgi.py --concurrency 50 200 --requests 2000
+    DATABASE_URI=postgresql://localhost/hng_bench python benchmarks/asgi_vs_wsgi.py
+
+Each server runs as a single process on a local port: the WSGI app on
+werkzeug's threaded server (a thread per connection) and the ASGI app on
+uvicorn. Clients hold ``concurrency`` keep-alive connections open and call
+GET /api/organisations. The report shows requests/sec, p99 latency and the
+server's resident memory growth divided by the number of open connections.
+Requires httpx and uvicorn.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'asgi_bench.db'))
+os.environ.setdefault('APP_SECRET_KEY', 'benchmark-secret-key-not-for-production')
+
+WSGI_SERVER = (
+    "import sys; from werkzeug.serving import run_simple; from app import app; "
+    "run_simple('127.0.0.1', int(sys.argv[1]), app, threaded=True)"
+)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def rss_kib(pid):
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def seed():
+    from flask_jwt_extended import create_access_token
+    from app import app, db
+    from models import User, Organisation
+
+    with app.app_context():
+        db.create_all()
+        if db.session.get(User, 'asgi-bench') is None:
+            user = User(userId='asgi-bench', firstName='Asgi', lastName='Bench', email='asgi-bench@example.com', password='x')
+            for i in range(20):
+                organisation = Organisation(orgId=f'asgi-bench-{i:02d}', name=f'Org {i}', description='')
+                organisation.users.append(user)
+            db.session.add(user)
+            db.session.commit()
+        return create_access_token(identity='asgi-bench')
+
+
+async def wait_ready(base):
+    async with httpx.AsyncClient() as client:
+        for _ in range(100):
+            try:
+                await client.get(base + '/')
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f'server at {base} did not start')
+
+
+async def load(base, token, concurrency, requests, pid):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    headers = {'Authorization': f'Bearer {token}'}
+    samples = []
+    remaining = iter(range(requests))
+    baseline = rss_kib(pid)
+    peak = baseline
+
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal peak
+            for _ in remaining:
+                started = time.perf_counter()
+                response = await client.get(base + '/api/organisations', headers=headers)
+                samples.append((time.perf_counter() - started) * 1000)
+                response.raise_for_status()
+                peak = max(peak, rss_kib(pid))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    samples.sort()
+    return {
+        'rps': requests / elapsed,
+        'p99': samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+        'kib_per_conn': (peak - baseline) / concurrency,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='*', default=[10, 50, 200])
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    token = seed()
+    servers = {
+        'wsgi': lambda port: [sys.executable, '-c', WSGI_SERVER, str(port)],
+        'asgi': lambda port: [sys.executable, '-m', 'uvicorn', 'asgi:application', '--port', str(port), '--log-level', 'warning'],
+    }
+    print(f"{'server':<7}{'conns':>7}{'req/s':>9}{'p99 ms':>9}{'KiB/conn':>10}")
+    for name, command in servers.items():
+        for concurrency in args.concurrency:
+            port = free_port()
+            process = subprocess.Popen(command(port), cwd=ROOT, env=os.environ.copy(),
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                base = f'http://127.0.0.1:{port}'
+                asyncio.run(wait_ready(base))
+                result = asyncio.run(load(base, token, concurrency, args.requests, process.pid))
+            finally:
+                process.terminate()
+                process.wait()
+            print(f"{name:<7}{concurrency:>7}{result['rps']:>9.0f}{result['p99']:>9.1f}{result['kib_per_conn']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
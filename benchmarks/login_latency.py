@@ -0,0 +1,67 @@
+"""Report p50/p99 /auth/login latency for a set of password hash profiles.
+
+    python benchmarks/login_latency.py --requests 200 scrypt:32768:8:1 scrypt:16384:8:1 pbkdf2:sha256:600000
+
+Runs against an in-memory SQLite database through the Flask test client, so
+the numbers are dominated by hashing cost rather than network or database I/O.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('DATABASE_URI', 'sqlite:///:memory:')
+os.environ.setdefault('APP_SECRET_KEY', 'benchmark-secret-key-not-for-production')
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-not-for-production')
+# Every run logs in as one user from one address; the login throttle would cut it off after a few requests
+os.environ['LOGIN_RATE_PER_IP'] = '0'
+os.environ['LOGIN_RATE_PER_EMAIL'] = '0'
+
+from app import app, db  # noqa: E402
+from hashing import hasher, normalize_method  # noqa: E402
+
+DEFAULT_PROFILES = ['scrypt:32768:8:1', 'scrypt:16384:8:1', 'pbkdf2:sha256:600000', 'pbkdf2:sha256:260000']
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def run_profile(client, method, requests):
+    hasher.method = normalize_method(method)
+    email = f'bench-{method}@example.com'
+    client.post('/auth/register', json={
+        'firstName': 'Bench', 'lastName': 'User', 'email': email, 'password': 'password123'
+    })
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.post('/auth/login', json={'email': email, 'password': 'password123'})
+        samples.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.get_json()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('profiles', nargs='*', default=DEFAULT_PROFILES)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        print(f"{'profile':<26}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+        for method in args.profiles:
+            samples = run_profile(client, method, args.requests)
+            print(f"{normalize_method(method):<26}{percentile(samples, 50):>10.1f}"
+                  f"{percentile(samples, 99):>10.1f}{statistics.mean(samples):>10.1f}")
+        hasher.shutdown()
+
+
+if __name__ == '__main__':
+    main()
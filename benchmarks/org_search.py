@@ -0,0 +1,94 @@
+"""Report p50/p99 latency of GET /api/organisations/search against a large organisation table.
+
+    python benchmarks/org_search.py --organisations 1000000 --memberships 100 10000
+    DATABASE_URI=postgresql://localhost/hng_bench python benchmarks/org_search.py
+
+Seeds ``--organisations`` organisations with generated names into
+DATABASE_URI (a temporary SQLite file by default; FTS5 or pg_trgm indexes are
+created with the tables), then for each membership count makes one user a
+member of that many organisations and times a mix of short prefix, word
+prefix, substring and misspelt queries through the Flask test client.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'search_bench.db'))
+os.environ.setdefault('APP_SECRET_KEY', 'benchmark-secret-key-not-for-production')
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-not-for-production')
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+from sqlalchemy import func, insert, select  # noqa: E402
+from app import app, db  # noqa: E402
+from models import User, Organisation, user_organisation  # noqa: E402
+
+WORDS = ['acme', 'global', 'pacific', 'northern', 'quantum', 'harbour', 'summit', 'vertex', 'orchid', 'granite',
+         'lumen', 'cobalt', 'meridian', 'atlas', 'beacon', 'cedar', 'delta', 'ember', 'falcon', 'horizon']
+SUFFIXES = ['Labs', 'Holdings', 'Traders', 'Systems', 'Partners', 'Foundation', 'Logistics', 'Studio']
+QUERIES = ['ac', 'Quantum', 'Harbour Lo', 'ridian', 'Quantm Sytems', 'cobalt partners']
+BATCH = 50000
+
+
+def organisation_name(rng):
+    return f'{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {rng.choice(SUFFIXES)} {rng.randrange(10000)}'
+
+
+def seed(count, rng):
+    existing = db.session.execute(select(func.count()).select_from(Organisation)).scalar()
+    for start in range(existing, count, BATCH):
+        rows = [{'orgId': str(uuid.UUID(int=rng.getrandbits(128))), 'name': organisation_name(rng), 'description': ''}
+                for _ in range(min(BATCH, count - start))]
+        db.session.execute(insert(Organisation), rows)
+        db.session.commit()
+        print(f'seeded {start + len(rows)} organisations', file=sys.stderr)
+
+
+def member_of(user_id, count):
+    db.session.add(User(userId=user_id, firstName='Search', lastName='Bench', email=f'{user_id}@example.com', password='x'))
+    org_ids = db.session.execute(select(Organisation.orgId).order_by(func.random()).limit(count)).scalars().all()
+    for start in range(0, len(org_ids), BATCH):
+        db.session.execute(insert(user_organisation),
+                           [{'user_id': user_id, 'organisation_id': org_id} for org_id in org_ids[start:start + BATCH]])
+    db.session.commit()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--organisations', type=int, default=1000000)
+    parser.add_argument('--memberships', type=int, nargs='*', default=[100, 10000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        seed(args.organisations, rng)
+        print(f"{'members':>8}  {'query':<18}{'hits':>6}{'p50 ms':>9}{'p99 ms':>9}")
+        for memberships in args.memberships:
+            user_id = f'search-bench-{memberships}-{uuid.uuid4().hex[:8]}'
+            member_of(user_id, memberships)
+            headers = {'Authorization': f'Bearer {create_access_token(identity=user_id)}'}
+            for query in QUERIES:
+                samples = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    response = client.get('/api/organisations/search', query_string={'q': query}, headers=headers)
+                    samples.append((time.perf_counter() - started) * 1000)
+                hits = len(response.get_json()['data']['organisations'])
+                print(f'{memberships:>8}  {query:<18}{hits:>6}{statistics.median(samples):>9.1f}{percentile(samples, 99):>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
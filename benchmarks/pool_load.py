@@ -0,0 +1,121 @@
+"""Load-test GET /api/organisations under each connection pool mode.
+
+    DATABASE_URI=postgresql://localhost/hng_bench python benchmarks/pool_load.py --concurrency 32 --requests 2000
+
+For every DB_POOL_MODE the app is started in a fresh process on a threaded
+WSGI server and hammered by concurrent clients. The report shows p50/p99
+latency, throughput, the peak number of pooled connections checked out, and
+on PostgreSQL the peak number of server backends for the database.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, ROOT)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))]
+
+
+def worker(args):
+    from sqlalchemy import text
+    from werkzeug.serving import make_server
+    from flask_jwt_extended import create_access_token
+    from app import app, db
+    from models import User, Organisation
+
+    with app.app_context():
+        db.create_all()
+        user = db.session.get(User, 'pool-bench')
+        if user is None:
+            user = User(userId='pool-bench', firstName='Pool', lastName='Bench', email='pool-bench@example.com', password='x')
+            for i in range(20):
+                organisation = Organisation(orgId=f'pool-bench-{i:02d}', name=f'Org {i}', description='')
+                organisation.users.append(user)
+            db.session.add(user)
+            db.session.commit()
+        token = create_access_token(identity='pool-bench')
+        engine = db.engine
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/api/organisations'
+
+    peak = {'checkedout': 0, 'backends': 0}
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            checkedout = engine.pool.checkedout() if hasattr(engine.pool, 'checkedout') else 0
+            peak['checkedout'] = max(peak['checkedout'], checkedout)
+            if engine.dialect.name == 'postgresql':
+                with engine.connect() as conn:
+                    backends = conn.execute(text(
+                        'SELECT count(*) FROM pg_stat_activity WHERE datname = current_database()'
+                    )).scalar()
+                peak['backends'] = max(peak['backends'], backends - 1)
+            time.sleep(0.05)
+
+    def call(_):
+        request = urllib.request.Request(url, headers={'Authorization': f'Bearer {token}'})
+        started = time.perf_counter()
+        with urllib.request.urlopen(request) as response:
+            response.read()
+        return (time.perf_counter() - started) * 1000
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        samples = list(pool.map(call, range(args.requests)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    sampler.join()
+    server.shutdown()
+
+    print(json.dumps({
+        'p50': percentile(samples, 50),
+        'p99': percentile(samples, 99),
+        'mean': statistics.mean(samples),
+        'rps': args.requests / elapsed,
+        'checkedout': peak['checkedout'],
+        'backends': peak['backends'],
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', nargs='*', default=['queue', 'null'])
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(args)
+
+    print(f"{'mode':<8}{'p50 ms':>9}{'p99 ms':>9}{'req/s':>9}{'pool out':>10}{'pg conns':>10}")
+    for mode in args.modes:
+        env = dict(os.environ, DB_POOL_MODE=mode)
+        env.setdefault('APP_SECRET_KEY', 'benchmark-secret-key-not-for-production')
+        output = subprocess.run(
+            [sys.executable, __file__, '--worker', '--concurrency', str(args.concurrency), '--requests', str(args.requests)],
+            env=env, cwd=ROOT, check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:<8}{result['p50']:>9.1f}{result['p99']:>9.1f}{result['rps']:>9.0f}"
+              f"{result['checkedout']:>10}{result['backends']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Measure the cost of serializing large organisation lists through Flask's JSON provider.
+
+    python benchmarks/serialization.py --orgs 100 1000 10000
+
+Compares Flask's default stdlib provider with the orjson-backed provider used
+by app.py, building the same response body the GET /api/organisations route
+returns.
+"""
+import argparse
+import os
+import sys
+import timeit
+import uuid
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+from serializers import ORJSONProvider, organisation_to_dict  # noqa: E402
+
+Row = namedtuple('Row', 'orgId name description')
+
+
+def body(rows):
+    return {
+        "status": "success",
+        "message": "Organisations retrieved successfully",
+        "data": {
+            "organisations": [organisation_to_dict(row) for row in rows],
+            "nextCursor": None
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orgs', type=int, nargs='*', default=[100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    providers = {}
+    for name, cls in (('stdlib', DefaultJSONProvider), ('orjson', ORJSONProvider)):
+        app = Flask(name)
+        app.json = cls(app)
+        app.json.sort_keys = False
+        providers[name] = app
+
+    print(f"{'orgs':>7}{'stdlib ms':>12}{'orjson ms':>12}{'speedup':>9}{'bytes':>10}")
+    for count in args.orgs:
+        rows = [Row(str(uuid.uuid4()), f'Organisation {i}', f"Owner {i}'s organisation") for i in range(count)]
+        timings = {}
+        for name, app in providers.items():
+            with app.app_context():
+                run = lambda: app.json.response(body(rows)).get_data()  # noqa: E731
+                size = len(run())
+                timings[name] = min(timeit.repeat(run, number=1, repeat=args.repeat)) * 1000
+        print(f"{count:>7}{timings['stdlib']:>12.2f}{timings['orjson']:>12.2f}"
+              f"{timings['stdlib'] / timings['orjson']:>8.1f}x{size:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Compare signup throughput of the old two-commit save_user with the current one.
+
+    python benchmarks/signup_throughput.py --users 2000
+    DATABASE_URI=postgresql://localhost/hng_bench python benchmarks/signup_throughput.py
+
+Passwords are pre-hashed once so the numbers measure database round trips and
+commits only. Defaults to a file-backed SQLite database so commits hit disk.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'signup.db'))
+os.environ.setdefault('APP_SECRET_KEY', 'benchmark-secret-key-not-for-production')
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+from app import app, db  # noqa: E402
+from models import User, Organisation  # noqa: E402
+from validate import Validate  # noqa: E402
+
+
+def save_user_two_commits(user_data):
+    """The previous Validate.save_user: commit the user, then the organisation."""
+    user = User(**user_data)
+    db.session.add(user)
+    db.session.commit()
+    organisation = Organisation(
+        orgId=str(uuid.uuid4()),
+        name=f"{user.firstName}'s Organisation",
+        description=f"{user.firstName} {user.lastName}'s organisation"
+    )
+    user.organisations.append(organisation)
+    db.session.add(organisation)
+    db.session.commit()
+    return user
+
+
+def run(save, label, users, password):
+    started = time.perf_counter()
+    for _ in range(users):
+        user_id = str(uuid.uuid4())
+        save({
+            'userId': user_id,
+            'firstName': 'Bench',
+            'lastName': 'User',
+            'email': f'{user_id}@example.com',
+            'password': password
+        })
+    elapsed = time.perf_counter() - started
+    print(f'{label:<14}{users:>8}{elapsed:>10.2f}s{users / elapsed:>12.1f} signups/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+
+    password = generate_password_hash('password123', method='pbkdf2:sha256:1')
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        print(f"{'variant':<14}{'users':>8}{'elapsed':>11}{'throughput':>22}")
+        run(save_user_two_commits, 'two commits', args.users, password)
+        run(Validate.save_user, 'one commit', args.users, password)
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
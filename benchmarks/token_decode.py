@@ -0,0 +1,75 @@
+"""Measure JWT verification cost per request with and without the decoded-token cache.
+
+    python benchmarks/token_decode.py --requests 20000 --tokens 1 50
+
+For each number of distinct tokens in rotation it reports the mean time spent
+in ``decode_token`` (what ``@jwt_required`` runs per request) and the mean
+time for a full GET /api/users/<self> through the Flask test client, first
+with ``JWT_DECODE_CACHE_SIZE = 0`` and then with the cache on.
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('DATABASE_URI', 'sqlite:///:memory:')
+os.environ.setdefault('APP_SECRET_KEY', 'benchmark-secret-key-not-for-production')
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-not-for-production')
+
+from flask_jwt_extended import create_access_token, decode_token  # noqa: E402
+from app import app, db, jwt  # noqa: E402
+from models import User  # noqa: E402
+from cache import LRUCache  # noqa: E402
+
+
+def configure(size):
+    # Same as starting with JWT_DECODE_CACHE_SIZE = size; init_app cannot run again after a request
+    jwt.decode_cache = LRUCache(maxsize=size, ttl=0)
+
+
+def time_decode(tokens, requests):
+    rotation = itertools.cycle(tokens)
+    started = time.perf_counter()
+    for _ in range(requests):
+        decode_token(next(rotation))
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+def time_requests(client, user_ids, tokens, requests):
+    rotation = itertools.cycle(zip(user_ids, tokens))
+    started = time.perf_counter()
+    for _ in range(requests):
+        user_id, token = next(rotation)
+        client.get(f'/api/users/{user_id}', headers={'Authorization': f'Bearer {token}'}).close()
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--tokens', type=int, nargs='*', default=[1, 50])
+    args = parser.parse_args()
+
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        user_ids = [f'decode-bench-{i}' for i in range(max(args.tokens))]
+        db.session.add_all([User(userId=user_id, firstName='Decode', lastName='Bench',
+                                 email=f'{user_id}@example.com', password='x') for user_id in user_ids])
+        db.session.commit()
+        all_tokens = [create_access_token(identity=user_id) for user_id in user_ids]
+
+        print(f"{'tokens':>7}{'cache':>7}{'decode us':>11}{'request us':>12}")
+        for count in args.tokens:
+            for size in (0, 4096):
+                configure(size)
+                tokens = all_tokens[:count]
+                decode_us = time_decode(tokens, args.requests)
+                request_us = time_requests(client, user_ids[:count], tokens, args.requests // 10)
+                print(f"{count:>7}{'on' if size else 'off':>7}{decode_us:>11.1f}{request_us:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy.orm import make_transient_to_detached
+from models import db, User, Organisation
+from metrics import registry
+
+cache_requests = registry.counter('cache_requests_total', 'Model cache lookups', ('kind', 'result'))
+
+
+class CacheBackend():
+    """Storage interface for ``ModelCache``; values are plain JSON-able dicts."""
+
+    def get(self, key, default=None):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    """Thread-safe in-process LRU with a per-entry time to live."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._data.move_to_end(key)
+                return entry[0]
+            if entry is not None:
+                del self._data[key]
+            return default
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache(CacheBackend):
+    """Backend for any client exposing redis-py's ``get``/``set(ex=)``/``delete``/``scan_iter``."""
+
+    def __init__(self, client, prefix='hng:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key, default=None):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return default
+        return json.loads(value)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(ttl)))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+
+def _attach(model, row):
+    # Rebuild a persistent instance from cached columns without issuing a SELECT
+    instance = model(**row)
+    make_transient_to_detached(instance)
+    return db.session.merge(instance, load=False)
+
+
+class ModelCache():
+    """Read-through cache for User and Organisation lookups by primary key.
+
+    Only the public profile columns are cached (never the password hash), and
+    the cache is bypassed entirely when ``CACHE_TTL`` is 0. Writers call the
+    ``invalidate_*`` methods after committing.
+    """
+
+    USER_COLUMNS = ('userId', 'firstName', 'lastName', 'email', 'phone', 'version')
+    ORGANISATION_COLUMNS = ('orgId', 'name', 'description', 'version')
+
+    def __init__(self, app=None):
+        self.backend = LRUCache()
+        self.ttl = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_BACKEND', 'memory')
+        app.config.setdefault('CACHE_TTL', 0)
+        app.config.setdefault('CACHE_SIZE', 1024)
+        app.config.setdefault('CACHE_REDIS_URL', None)
+        self.ttl = float(app.config['CACHE_TTL'])
+        if app.config['CACHE_BACKEND'] == 'redis':
+            import redis
+            self.backend = RedisCache(redis.Redis.from_url(app.config['CACHE_REDIS_URL']))
+        else:
+            self.backend = LRUCache(maxsize=int(app.config['CACHE_SIZE']), ttl=self.ttl)
+        app.extensions['model_cache'] = self
+
+    def _get(self, kind, model, columns, key, **filters):
+        if not self.ttl:
+            return model.query.filter_by(**filters).first()
+        row = self.backend.get(f'{kind}:{key}')
+        if row is not None:
+            cache_requests.inc(kind=kind, result='hit')
+            return _attach(model, row)
+        cache_requests.inc(kind=kind, result='miss')
+        instance = model.query.filter_by(**filters).first()
+        if instance is not None:
+            self.backend.set(f'{kind}:{key}', {column: getattr(instance, column) for column in columns}, self.ttl)
+        return instance
+
+    def get_user(self, user_id):
+        return self._get('user', User, self.USER_COLUMNS, user_id, userId=user_id)
+
+    def get_organisation(self, org_id):
+        return self._get('organisation', Organisation, self.ORGANISATION_COLUMNS, org_id, orgId=org_id)
+
+    def invalidate_user(self, user_id):
+        self.backend.delete(f'user:{user_id}')
+
+    def invalidate_organisation(self, org_id):
+        self.backend.delete(f'organisation:{org_id}')
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {
+            kind: {result: cache_requests.value(kind=kind, result=result) for result in ('hit', 'miss')}
+            for kind in ('user', 'organisation')
+        }
+
+
+model_cache = ModelCache()
@@ -0,0 +1,254 @@
+import hashlib
+import math
+import threading
+import time
+
+from sqlalchemy import select
+from models import db, User
+from metrics import registry
+
+LOAD_BATCH = 1000
+
+filter_lookups = registry.counter('email_filter_lookups_total', 'Email filter lookups', ('result',))
+
+
+class BitStore():
+    """Bit array interface behind ``EmailFilter``."""
+
+    def set_bits(self, positions):
+        raise NotImplementedError
+
+    def all_set(self, positions):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryBitStore(BitStore):
+
+    def __init__(self, size):
+        self.size = size
+        self._bits = bytearray((size + 7) // 8)
+
+    def set_bits(self, positions):
+        for position in positions:
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def all_set(self, positions):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in positions)
+
+    def clear(self):
+        self._bits = bytearray(len(self._bits))
+
+
+class RedisBitStore(BitStore):
+    """Bits in one Redis string, shared by every worker; any redis-py compatible client works.
+
+    One worker claims the load with ``claim_load`` and sets the complete flag
+    with ``finish_load`` once every email is in; until then ``lookup`` reports
+    the bits as incomplete. The claim expires, so a loader that dies is replaced.
+    """
+
+    def __init__(self, client, key='hng:email-filter'):
+        self.client = client
+        self.key = key
+
+    def set_bits(self, positions):
+        pipe = self.client.pipeline(transaction=False)
+        for position in positions:
+            pipe.setbit(self.key, position, 1)
+        pipe.execute()
+
+    def all_set(self, positions):
+        return self.lookup(positions)[1]
+
+    def lookup(self, positions):
+        """(load complete, all bits set) in one round trip."""
+        pipe = self.client.pipeline(transaction=False)
+        pipe.exists(self.key + ':complete')
+        for position in positions:
+            pipe.getbit(self.key, position)
+        complete, *bits = pipe.execute()
+        return bool(complete), all(bits)
+
+    def clear(self):
+        self.client.delete(self.key, self.key + ':loading', self.key + ':complete')
+
+    def claim_load(self, timeout):
+        """True for the one worker that should populate the filter in the next ``timeout`` seconds."""
+        return bool(self.client.set(self.key + ':loading', 1, nx=True, ex=max(1, math.ceil(timeout))))
+
+    def finish_load(self):
+        self.client.set(self.key + ':complete', 1)
+        self.client.delete(self.key + ':loading')
+
+
+def filter_size(capacity, error_rate):
+    """(bits, hash count) for a bloom filter holding ``capacity`` items at ``error_rate``."""
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    return bits, max(1, round(bits / capacity * math.log(2)))
+
+
+class EmailFilter():
+    """Bloom filter over ``User.email`` answering "definitely not registered".
+
+    A miss means no user has that email, so login can fail and registration can
+    skip the duplicate check without a query; a hit still goes to the database.
+    Disabled unless ``EMAIL_FILTER`` is set, in which case ``might_contain``
+    always answers True. Writers call ``add`` after committing new users.
+
+    The memory backend is per process and rebuilt from the table every
+    ``EMAIL_FILTER_REFRESH`` seconds, so it misses registrations made by other
+    workers in between. Its misses are only used where a wrong one is harmless
+    (the registration duplicate check, which the unique constraint backs up);
+    login only trusts ``authoritative`` misses, which come from the redis
+    backend once its load has completed.
+
+    Loads and refreshes run on a background thread. Until the first load has
+    finished every lookup answers "maybe", so callers fall through to the database;
+    a stale memory filter keeps answering from its old bits while it is rebuilt.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.store = None
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending = None
+        self._app = None
+        self._loader = None
+        self._load_started = None
+        self.retry_interval = 5
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('EMAIL_FILTER', False)
+        app.config.setdefault('EMAIL_FILTER_CAPACITY', 1000000)
+        app.config.setdefault('EMAIL_FILTER_ERROR_RATE', 0.01)
+        app.config.setdefault('EMAIL_FILTER_BACKEND', 'memory')
+        app.config.setdefault('EMAIL_FILTER_REDIS_URL', None)
+        app.config.setdefault('EMAIL_FILTER_REFRESH', 300)
+        app.config.setdefault('EMAIL_FILTER_LOAD_TIMEOUT', 600)
+        self.enabled = bool(app.config['EMAIL_FILTER'])
+        self.capacity = int(app.config['EMAIL_FILTER_CAPACITY'])
+        self.error_rate = float(app.config['EMAIL_FILTER_ERROR_RATE'])
+        self.refresh = float(app.config['EMAIL_FILTER_REFRESH'])
+        self.load_timeout = float(app.config['EMAIL_FILTER_LOAD_TIMEOUT'])
+        self.bits, self.hashes = filter_size(self.capacity, self.error_rate)
+        if app.config['EMAIL_FILTER_BACKEND'] == 'redis':
+            import redis
+            self.store = RedisBitStore(redis.Redis.from_url(app.config['EMAIL_FILTER_REDIS_URL']))
+        else:
+            self.store = MemoryBitStore(self.bits)
+        self.loaded_at = None
+        self._app = app
+        self._loader = None
+        self._load_started = None
+        app.extensions['email_filter'] = self
+
+    def positions(self, email):
+        digest = hashlib.blake2b(email.strip().lower().encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def load(self):
+        """Fill the filter from the user table; needs an app context."""
+        query = select(User.email).execution_options(yield_per=10000)
+        if isinstance(self.store, MemoryBitStore):
+            # Emails added while the snapshot is read are replayed onto the new bits
+            with self._pending_lock:
+                self._pending = []
+            store = MemoryBitStore(self.bits)
+            for email in db.session.execute(query).scalars():
+                store.set_bits(self.positions(email))
+            with self._pending_lock:
+                for email in self._pending:
+                    store.set_bits(self.positions(email))
+                self.store = store
+                self._pending = None
+            self.loaded_at = time.monotonic()
+        elif self.store.claim_load(self.load_timeout):
+            # One pipeline round trip per LOAD_BATCH emails
+            for emails in db.session.execute(query).scalars().partitions(LOAD_BATCH):
+                self.store.set_bits([position for email in emails for position in self.positions(email)])
+            self.store.finish_load()
+
+    def _run_load(self):
+        with self._app.app_context():
+            self.load()
+
+    def start_load(self):
+        """Load or refresh on a background thread, unless one is running or started within ``retry_interval``."""
+        with self._lock:
+            if self._loader is not None and self._loader.is_alive():
+                return
+            now = time.monotonic()
+            if self._load_started is not None and now - self._load_started < self.retry_interval:
+                return
+            self._load_started = now
+            self._loader = threading.Thread(target=self._run_load, name='email-filter-load', daemon=True)
+            self._loader.start()
+
+    def wait_loaded(self, timeout=None):
+        """Block until the background load started last has finished."""
+        loader = self._loader
+        if loader is not None:
+            loader.join(timeout)
+
+    def _stale(self):
+        if self.loaded_at is None:
+            return True
+        return time.monotonic() - self.loaded_at > self.refresh
+
+    def _lookup(self, positions):
+        """(complete, found); an unloaded or stale filter starts a background load."""
+        if isinstance(self.store, MemoryBitStore):
+            if self._stale():
+                self.start_load()
+            if self.loaded_at is None:
+                return False, True
+            return True, self.store.all_set(positions)
+        complete, found = self.store.lookup(positions)
+        if not complete:
+            # Ours, or a replacement for another worker's load whose claim expired
+            self.start_load()
+        return complete, found
+
+    def might_contain(self, email, authoritative=False):
+        """False only if no user has ``email``.
+
+        With ``authoritative``, only misses that hold for every process count:
+        the memory backend and a redis filter still being loaded answer True.
+        """
+        if not self.enabled:
+            return True
+        if not isinstance(email, str):
+            # Emails are stored as strings, so nothing else can be registered
+            return False
+        if authoritative and isinstance(self.store, MemoryBitStore):
+            return True
+        complete, found = self._lookup(self.positions(email))
+        if not complete:
+            # Half-filled bits would turn registered users away; let the database answer
+            filter_lookups.inc(result='loading')
+            return True
+        filter_lookups.inc(result='maybe' if found else 'absent')
+        return found
+
+    def add(self, *emails):
+        if not self.enabled:
+            return
+        emails = [email for email in emails if isinstance(email, str)]
+        with self._pending_lock:
+            if self._pending is not None:
+                self._pending.extend(emails)
+            # Redis bits are shared, so they take adds even before this process has loaded
+            if self.loaded_at is not None or not isinstance(self.store, MemoryBitStore):
+                for email in emails:
+                    self.store.set_bits(self.positions(email))
+
+
+email_filter = EmailFilter()
@@ -0,0 +1,31 @@
+import hashlib
+
+from flask import current_app, request
+
+
+def resource_etag(kind, key, version):
+    """Strong ETag for one row, from its ``version`` column."""
+    return f'{kind}-{key}-{version}'
+
+
+def collection_etag(*parts, rows=(), key='orgId'):
+    """Strong ETag for a list response, from the key and ``version`` of every row in it."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(parts).encode())
+    for row in rows:
+        digest.update(f'{getattr(row, key)}:{row.version};'.encode())
+    return digest.hexdigest()
+
+
+def not_modified(etag):
+    """A bodiless 304 when the request's If-None-Match already names ``etag``, otherwise None."""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def tagged(response, etag):
+    response.set_etag(etag)
+    return response
@@ -0,0 +1,173 @@
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+from metrics import registry
+
+queue_depth = registry.gauge('password_hash_queue_depth', 'Password hash jobs submitted and not yet finished')
+hash_seconds = registry.histogram('password_hash_seconds', 'Time spent hashing or checking a password', ('op',))
+hash_rejected = registry.counter('password_hash_rejected_total', 'Password hash jobs rejected because the pool was saturated')
+
+
+def default_workers(env=os.environ):
+    """One hashing process per CPU; none (hash inline) on Vercel, whose Lambda sandbox has no /dev/shm for pool semaphores."""
+    return 0 if env.get('VERCEL') else os.cpu_count() or 1
+
+
+def pool_context():
+    # Not fork: the pool is started from a threaded request handler, and forking a
+    # threaded process can copy locks held by other threads
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+class HashingBusy(Exception):
+
+    def __init__(self, retry_after):
+        super().__init__('Password hashing pool is saturated')
+        self.retry_after = retry_after
+
+
+def normalize_method(method):
+    """Expand a werkzeug method string to the form it writes into hashes."""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        if not args:
+            args = ['32768', '8', '1']
+        if len(args) != 3:
+            raise ValueError("'scrypt' takes 3 arguments.")
+    elif name == 'pbkdf2':
+        if not args:
+            args = ['sha256']
+        if len(args) == 1:
+            args.append(str(DEFAULT_PBKDF2_ITERATIONS))
+        if len(args) != 2:
+            raise ValueError("'pbkdf2' takes 2 arguments.")
+    else:
+        raise ValueError(f"Invalid hash method '{method}'.")
+    return ':'.join([name] + [str(arg) for arg in args])
+
+
+class PasswordHasher():
+    """Runs werkzeug password hashing on a bounded process pool.
+
+    At most ``workers + queue_size`` jobs are accepted at once; anything
+    beyond that raises ``HashingBusy`` instead of queueing behind the burst.
+    ``HASH_WORKERS = 0`` hashes inline on the request thread.
+
+    ``generate_many`` runs on a separate pool of ``HASH_BULK_WORKERS``
+    processes, so a bulk import never puts its jobs in front of a login.
+
+    New hashes use ``PASSWORD_HASH_METHOD`` (any werkzeug method string such
+    as ``scrypt:16384:8:1`` or ``pbkdf2:sha256:600000``); ``needs_rehash``
+    reports stored hashes written with a different method or cost.
+    """
+
+    def __init__(self, app=None):
+        self.workers = default_workers()
+        self.queue_size = self.workers * 4
+        self.retry_after = 1
+        self.method = normalize_method('scrypt')
+        self.salt_length = 16
+        self.bulk_workers = max(1, self.workers // 2)
+        self._executor = None
+        self._bulk_executor = None
+        self._dummy_hash = None
+        self._slots = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('HASH_WORKERS', self.workers)
+        app.config.setdefault('HASH_QUEUE_SIZE', self.queue_size)
+        app.config.setdefault('HASH_RETRY_AFTER', self.retry_after)
+        app.config.setdefault('HASH_BULK_WORKERS', max(1, int(app.config['HASH_WORKERS']) // 2))
+        app.config.setdefault('PASSWORD_HASH_METHOD', self.method)
+        app.config.setdefault('PASSWORD_SALT_LENGTH', self.salt_length)
+        self.workers = int(app.config['HASH_WORKERS'])
+        self.queue_size = int(app.config['HASH_QUEUE_SIZE'])
+        self.retry_after = int(app.config['HASH_RETRY_AFTER'])
+        self.bulk_workers = int(app.config['HASH_BULK_WORKERS'])
+        self.method = normalize_method(app.config['PASSWORD_HASH_METHOD'])
+        self.salt_length = int(app.config['PASSWORD_SALT_LENGTH'])
+        self._slots = threading.BoundedSemaphore(max(self.workers, 1) + self.queue_size)
+        self._dummy_hash = None
+        app.extensions['password_hasher'] = self
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=pool_context())
+                atexit.register(self.shutdown)
+            return self._executor
+
+    def _get_bulk_executor(self):
+        with self._lock:
+            if self._bulk_executor is None:
+                self._bulk_executor = ProcessPoolExecutor(max_workers=self.bulk_workers, mp_context=pool_context())
+                atexit.register(self.shutdown)
+            return self._bulk_executor
+
+    def shutdown(self):
+        with self._lock:
+            for executor in (self._executor, self._bulk_executor):
+                if executor is not None:
+                    executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._bulk_executor = None
+
+    def _run(self, op, fn, *args, **kwargs):
+        if self._slots is None:
+            raise RuntimeError('PasswordHasher is not initialised, call init_app() first')
+        if not self._slots.acquire(blocking=False):
+            hash_rejected.inc()
+            raise HashingBusy(self.retry_after)
+        queue_depth.inc()
+        started = time.perf_counter()
+        try:
+            if self.workers == 0:
+                return fn(*args, **kwargs)
+            return self._get_executor().submit(fn, *args, **kwargs).result()
+        finally:
+            hash_seconds.observe(time.perf_counter() - started, op=op)
+            queue_depth.dec()
+            self._slots.release()
+
+    def generate(self, password):
+        return self._run('generate', generate_password_hash, password,
+                         method=self.method, salt_length=self.salt_length)
+
+    def generate_many(self, passwords):
+        """Hash a batch on the bulk pool; it has no queue bound, but never delays request hashing."""
+        fn = partial(generate_password_hash, method=self.method, salt_length=self.salt_length)
+        started = time.perf_counter()
+        try:
+            if self.workers == 0 or self.bulk_workers == 0:
+                return [fn(password) for password in passwords]
+            chunksize = max(1, len(passwords) // (self.bulk_workers * 4))
+            return list(self._get_bulk_executor().map(fn, passwords, chunksize=chunksize))
+        finally:
+            hash_seconds.observe(time.perf_counter() - started, op='generate_batch')
+
+    def needs_rehash(self, pwhash):
+        return pwhash.split('$', 1)[0] != self.method
+
+    def check(self, pwhash, password):
+        return self._run('check', check_password_hash, pwhash, password)
+
+    def check_dummy(self, password):
+        """Spend the time of a real ``check`` when there is no stored hash to compare against."""
+        if self._dummy_hash is None:
+            # Built on the pool like any other hash, so it counts against the queue bound
+            self._dummy_hash = self.generate(os.urandom(16).hex())
+        self.check(self._dummy_hash, password)
+        return False
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,144 @@
+import hmac
+import threading
+import time
+
+from flask import Response, current_app, g, has_request_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from metrics import registry, CONTENT_TYPE
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+requests_total = registry.counter('http_requests_total', 'HTTP requests handled', ('route', 'method', 'status'))
+request_seconds = registry.histogram('http_request_duration_seconds', 'Time to handle an HTTP request', ('route', 'method'))
+request_queries = registry.histogram('db_queries_per_request', 'SQL statements executed while handling one request',
+                                     ('route',), buckets=QUERY_COUNT_BUCKETS)
+request_query_seconds = registry.histogram('db_query_seconds_per_request', 'Time spent in SQL while handling one request',
+                                           ('route',))
+query_seconds = registry.histogram('db_query_duration_seconds', 'Time to execute one SQL statement', ('dialect',))
+pool_checked_out = registry.gauge('db_pool_checked_out', 'Connections currently checked out of the pool', ('bind',))
+pool_size = registry.gauge('db_pool_size', 'Configured size of the connection pool', ('bind',))
+pool_overflow = registry.gauge('db_pool_overflow', 'Connections open beyond the pool size', ('bind',))
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, which is dropped with the statement even when it raises
+    context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_started
+    query_seconds.observe(elapsed, dialect=conn.dialect.name)
+    if has_request_context() and 'db_queries' in g:
+        g.db_queries += 1
+        g.db_query_seconds += elapsed
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter():
+    """Count SQL statements run on this thread inside a ``with`` block.
+
+        with QueryCounter(budget=2) as queries:
+            client.get('/api/users/abc', headers=headers)
+        queries.count, queries.statements
+
+    With a ``budget``, leaving the block raises ``QueryBudgetExceeded`` listing
+    every statement when more than ``budget`` ran.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.statements = []
+        self._thread = None
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self._thread:
+            self.statements.append(statement)
+
+    def __enter__(self):
+        self.statements = []
+        self._thread = threading.get_ident()
+        event.listen(Engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        event.remove(Engine, 'before_cursor_execute', self._record)
+        if exc_type is None and self.budget is not None and self.count > self.budget:
+            listing = '\n'.join(f'  {i}. {statement}' for i, statement in enumerate(self.statements, 1))
+            raise QueryBudgetExceeded(f'{self.count} queries run, budget is {self.budget}:\n{listing}')
+        return False
+
+
+class RequestMetrics():
+    """Per-route request counts and latency, SQL statement counts and timings, and pool usage.
+
+    Routes are labelled by endpoint name (``login_user``, ``get_user`` ...).
+    ``/metrics`` serves everything in ``metrics.registry``, password hashing
+    included, in the Prometheus text format. Set ``METRICS_TOKEN`` to require
+    it as a bearer token.
+    """
+
+    def __init__(self, app=None, db=None):
+        self.db = db
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('METRICS_TOKEN', None)
+        self.db = db
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/metrics', 'metrics', self.render)
+        registry.add_collector(self._collect_pools)
+        app.extensions['request_metrics'] = self
+
+    def _before_request(self):
+        g.request_started = time.perf_counter()
+        g.db_queries = 0
+        g.db_query_seconds = 0.0
+
+    def _after_request(self, response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        route = request.endpoint or 'unmatched'
+        request_seconds.observe(time.perf_counter() - started, route=route, method=request.method)
+        requests_total.inc(route=route, method=request.method, status=response.status_code)
+        request_queries.observe(g.pop('db_queries'), route=route)
+        request_query_seconds.observe(g.pop('db_query_seconds'), route=route)
+        return response
+
+    def _collect_pools(self):
+        if self.db is None or not has_request_context():
+            return
+        for bind, engine in self.db.engines.items():
+            pool = engine.pool
+            # NullPool and StaticPool keep no counts
+            if not hasattr(pool, 'checkedout'):
+                continue
+            label = bind or 'default'
+            pool_checked_out.set(pool.checkedout(), bind=label)
+            pool_size.set(pool.size(), bind=label)
+            pool_overflow.set(max(0, pool.overflow()), bind=label)
+
+    def render(self):
+        token = current_app.config['METRICS_TOKEN']
+        if token and not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+            return jsonify({
+                "status": "Unauthorized",
+                "message": "Metrics token required",
+                "statusCode": 401
+            }), 401
+        return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
+request_metrics = RequestMetrics()
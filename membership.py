@@ -0,0 +1,184 @@
+from sqlalchemy import and_, exists, insert, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, user_organisation, User, Organisation
+
+INSERT_CHUNK_SIZE = 1000
+
+
+class Membership():
+    """Yes/no membership questions answered straight from ``user_organisation``.
+
+    These avoid loading ``User.organisations`` / ``Organisation.users`` just to
+    test for one row. The ``*_query`` builders are shared with the async app,
+    which executes them on its own session.
+    """
+
+    @staticmethod
+    def is_member_query(user_id, org_id):
+        return select(exists().where(
+            user_organisation.c.user_id == user_id,
+            user_organisation.c.organisation_id == org_id
+        ))
+
+    @staticmethod
+    def is_member(user_id, org_id):
+        return db.session.execute(Membership.is_member_query(user_id, org_id)).scalar()
+
+    @staticmethod
+    def shares_organisation_query(user_id, other_user_id):
+        mine = user_organisation.alias('mine')
+        theirs = user_organisation.alias('theirs')
+        return select(exists().where(
+            mine.c.user_id == user_id,
+            theirs.c.user_id == other_user_id,
+            mine.c.organisation_id == theirs.c.organisation_id
+        ))
+
+    @staticmethod
+    def shares_organisation(user_id, other_user_id):
+        return db.session.execute(Membership.shares_organisation_query(user_id, other_user_id)).scalar()
+
+    @staticmethod
+    def visible_users_query(user_id, other_user_ids):
+        """(userId, firstName, lastName, email, phone, visible) for every existing user in ``other_user_ids``.
+
+        ``visible`` is true for ``user_id`` itself and for users sharing an
+        organisation with it; the check is a correlated EXISTS over the two
+        ``user_organisation`` indexes, so the whole batch is one round trip.
+        """
+        mine = user_organisation.alias('mine')
+        theirs = user_organisation.alias('theirs')
+        shares = exists().where(
+            mine.c.user_id == user_id,
+            theirs.c.user_id == User.userId,
+            mine.c.organisation_id == theirs.c.organisation_id
+        )
+        return (
+            select(User.userId, User.firstName, User.lastName, User.email, User.phone,
+                   or_(User.userId == user_id, shares).label('visible'))
+            .where(User.userId.in_(other_user_ids))
+        )
+
+    @staticmethod
+    def visible_users(user_id, other_user_ids):
+        """``{userId: row}`` for the existing users in ``other_user_ids``; see ``visible_users_query``."""
+        rows = db.session.execute(Membership.visible_users_query(user_id, other_user_ids))
+        return {row.userId: row for row in rows}
+
+    @staticmethod
+    def add(user_id, org_id):
+        db.session.execute(insert(user_organisation).values(user_id=user_id, organisation_id=org_id))
+
+    @staticmethod
+    def touch_statements(org_id, user_ids):
+        """UPDATEs bumping ``version`` on an organisation and the users whose membership of it changed.
+
+        Pass ``org_id = None`` for an organisation inserted in the same
+        transaction: it has never been served, so only the users need bumping.
+        """
+        if org_id is not None:
+            yield update(Organisation).where(Organisation.orgId == org_id).values(version=Organisation.version + 1)
+        if user_ids:
+            yield update(User).where(User.userId.in_(user_ids)).values(version=User.version + 1)
+
+    @staticmethod
+    def touch(org_id, user_ids):
+        """Invalidate the ETags of ``org_id`` and ``user_ids`` after a membership change; the caller commits."""
+        for statement in Membership.touch_statements(org_id, list(user_ids)):
+            db.session.execute(statement)
+
+    @staticmethod
+    def organisations_page_query(user_id, after=None, limit=50):
+        """Up to ``limit + 1`` (orgId, name, description, version) rows for ``user_id``, ordered by orgId.
+
+        The filter and sort run on ``user_organisation``'s (user_id, organisation_id)
+        primary key, so each page is an index range scan starting after ``after``.
+        """
+        query = (
+            select(Organisation.orgId, Organisation.name, Organisation.description, Organisation.version)
+            .join(user_organisation, user_organisation.c.organisation_id == Organisation.orgId)
+            .where(user_organisation.c.user_id == user_id)
+            .order_by(user_organisation.c.organisation_id)
+            .limit(limit + 1)
+        )
+        if after is not None:
+            query = query.where(user_organisation.c.organisation_id > after)
+        return query
+
+    @staticmethod
+    def organisations_page(user_id, after=None, limit=50):
+        return db.session.execute(Membership.organisations_page_query(user_id, after, limit)).all()
+
+    @staticmethod
+    def members_query(org_id, after=None, limit=None):
+        """(userId, firstName, lastName, email, phone) of ``org_id``'s members ordered by userId.
+
+        Filter and sort run on the (organisation_id, user_id) index; with a ``limit``
+        the query asks for ``limit + 1`` rows so the caller can tell if more follow.
+        """
+        query = (
+            select(User.userId, User.firstName, User.lastName, User.email, User.phone)
+            .join(user_organisation, user_organisation.c.user_id == User.userId)
+            .where(user_organisation.c.organisation_id == org_id)
+            .order_by(user_organisation.c.user_id)
+        )
+        if after is not None:
+            query = query.where(user_organisation.c.user_id > after)
+        if limit is not None:
+            query = query.limit(limit + 1)
+        return query
+
+    @staticmethod
+    def add_many_query(org_id, user_ids):
+        """(userId, user_id-if-already-a-member) for every existing user in ``user_ids``."""
+        return (
+            select(User.userId, user_organisation.c.user_id)
+            .outerjoin(user_organisation, and_(
+                user_organisation.c.user_id == User.userId,
+                user_organisation.c.organisation_id == org_id
+            ))
+            .where(User.userId.in_(user_ids))
+        )
+
+    @staticmethod
+    def plan_add_many(org_id, user_ids, rows):
+        """Classify ``user_ids`` against ``add_many_query`` rows; returns (results, rows to insert)."""
+        found = {user_id: member is not None for user_id, member in rows}
+        results = {}
+        missing = []
+        for user_id in user_ids:
+            if user_id not in found:
+                results[user_id] = 'notFound'
+            elif found[user_id]:
+                results[user_id] = 'alreadyMember'
+            else:
+                results[user_id] = 'added'
+                missing.append({'user_id': user_id, 'organisation_id': org_id})
+        return results, missing
+
+    @staticmethod
+    def insert_ignore_statements(dialect, rows):
+        """Multi-row ``user_organisation`` inserts that skip rows already present."""
+        for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+            chunk = rows[start:start + INSERT_CHUNK_SIZE]
+            if dialect == 'postgresql':
+                yield postgresql.insert(user_organisation).values(chunk).on_conflict_do_nothing()
+            elif dialect == 'sqlite':
+                yield sqlite.insert(user_organisation).values(chunk).on_conflict_do_nothing()
+            else:
+                yield insert(user_organisation).values(chunk)
+
+    @staticmethod
+    def add_many(org_id, user_ids):
+        """Add every existing user in ``user_ids`` to ``org_id``; returns ``{userId: status}``.
+
+        Status is ``added``, ``alreadyMember`` or ``notFound``. Existence and current
+        membership are resolved with one ``IN`` query, and the new rows go in as
+        multi-row inserts that ignore conflicts from concurrent adds. The caller commits.
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        rows = db.session.execute(Membership.add_many_query(org_id, user_ids))
+        results, missing = Membership.plan_add_many(org_id, user_ids, rows)
+        for statement in Membership.insert_ignore_statements(db.session.get_bind().dialect.name, missing):
+            db.session.execute(statement)
+        return results
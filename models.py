@@ -1,11 +1,14 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
 from uuid import uuid4
+from routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 user_organisation = db.Table('user_organisation',
     db.Column('user_id', db.String(80), db.ForeignKey('user.userId'), primary_key=True),
-    db.Column('organisation_id', db.String(80), db.ForeignKey('organisation.orgId'), primary_key=True)
+    db.Column('organisation_id', db.String(80), db.ForeignKey('organisation.orgId'), primary_key=True),
+    db.Index('ix_user_organisation_organisation_id_user_id', 'organisation_id', 'user_id')
 )
 
 class User(db.Model):
@@ -15,6 +18,8 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(255), nullable=False)
     phone = db.Column(db.String(120))
+    # Bumped on every update and membership change; the ETag of GET /api/users/<id>
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     organisations = db.relationship('Organisation', secondary=user_organisation, backref='users')
 
 
@@ -25,6 +30,43 @@ class Organisation(db.Model):
     orgId = db.Column(db.String(80), unique=True, primary_key=True, default=lambda: str(uuid4()))
     name = db.Column(db.String(120), nullable=False)
     description = db.Column(db.String(255))
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
 
     def __repr__(self):
-        return f'<Organisation {self.name}>'
\ No newline at end of file
+        return f'<Organisation {self.name}>'
+
+# Name search indexes (see search.py): a trigram GIN index on PostgreSQL, and an
+# external-content FTS5 table kept in sync by triggers on SQLite
+for statement in (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_organisation_name_trgm ON organisation USING gin (name gin_trgm_ops)",
+):
+    event.listen(Organisation.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+for statement in (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS organisation_fts USING fts5("
+    "name, content='organisation', content_rowid='rowid', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS organisation_fts_ai AFTER INSERT ON organisation BEGIN "
+    "INSERT INTO organisation_fts(rowid, name) VALUES (new.rowid, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS organisation_fts_ad AFTER DELETE ON organisation BEGIN "
+    "INSERT INTO organisation_fts(organisation_fts, rowid, name) VALUES ('delete', old.rowid, old.name); END",
+    "CREATE TRIGGER IF NOT EXISTS organisation_fts_au AFTER UPDATE OF name ON organisation BEGIN "
+    "INSERT INTO organisation_fts(organisation_fts, rowid, name) VALUES ('delete', old.rowid, old.name); "
+    "INSERT INTO organisation_fts(rowid, name) VALUES (new.rowid, new.name); END",
+):
+    event.listen(Organisation.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Organisation.__table__, 'before_drop', DDL("DROP TABLE IF EXISTS organisation_fts").execute_if(dialect='sqlite'))
+
+@event.listens_for(User, 'before_update')
+@event.listens_for(Organisation, 'before_update')
+def bump_version(mapper, connection, target):
+    # Incremented in SQL so concurrent bumps never collapse into one
+    target.version = type(target).version + 1
+
+class TokenVersion(db.Model):
+    user_id = db.Column(db.String(80), db.ForeignKey('user.userId'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    membership_version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<TokenVersion {self.user_id} v{self.version}>'
@@ -0,0 +1,34 @@
+import base64
+import binascii
+
+
+def encode_cursor(value):
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Turn an opaque cursor back into the key it was built from; ``ValueError`` if malformed."""
+    if not token:
+        return None
+    try:
+        return base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+
+def parse_limit(value, default, maximum):
+    if value is None or value == '':
+        return default
+    limit = int(value)
+    if limit < 1 or limit > maximum:
+        raise ValueError(f'limit must be between 1 and {maximum}')
+    return limit
+
+
+def keyset_page(rows, limit, key):
+    """Split a ``limit + 1`` row fetch into the page and the cursor for the next one."""
+    rows = list(rows)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(key(rows[-1]))
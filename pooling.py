@@ -0,0 +1,46 @@
+import os
+
+from sqlalchemy.pool import NullPool
+
+
+def _flag(value):
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+def engine_options(uri, env=os.environ):
+    """Build ``SQLALCHEMY_ENGINE_OPTIONS`` for ``uri`` from ``DB_*`` environment settings.
+
+    ``DB_POOL_MODE=queue`` keeps a tuned connection pool per process.
+    ``DB_POOL_MODE=null`` opens a connection per checkout and closes it on
+    release, for serverless instances sitting behind an external pooler such
+    as PgBouncer; it is the default when running on Vercel.
+    """
+    mode = env.get('DB_POOL_MODE') or ('null' if env.get('VERCEL') else 'queue')
+    if mode not in ('queue', 'null'):
+        raise ValueError(f"Invalid DB_POOL_MODE '{mode}'.")
+
+    options = {}
+    if not uri or uri.startswith('sqlite'):
+        # Flask-SQLAlchemy picks a suitable pool for SQLite itself
+        return options
+
+    if mode == 'null':
+        options['poolclass'] = NullPool
+    else:
+        options['pool_size'] = int(env.get('DB_POOL_SIZE', 5))
+        options['max_overflow'] = int(env.get('DB_MAX_OVERFLOW', 10))
+        options['pool_timeout'] = float(env.get('DB_POOL_TIMEOUT', 30))
+        # Recycle before the platform or load balancer drops idle connections
+        options['pool_recycle'] = int(env.get('DB_POOL_RECYCLE', 300))
+        options['pool_pre_ping'] = _flag(env.get('DB_POOL_PRE_PING', 'true'))
+        options['pool_use_lifo'] = True
+
+    if uri.startswith('postgres'):
+        options['connect_args'] = {
+            'connect_timeout': int(env.get('DB_CONNECT_TIMEOUT', 5)),
+            'keepalives': 1,
+            'keepalives_idle': int(env.get('DB_KEEPALIVES_IDLE', 30)),
+            'keepalives_interval': 10,
+            'keepalives_count': 3,
+        }
+    return options
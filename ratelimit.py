@@ -0,0 +1,132 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import registry
+
+throttled_attempts = registry.counter('login_throttled_total', 'Login attempts rejected by the rate limiter', ('scope',))
+
+
+class RateLimited(Exception):
+
+    def __init__(self, retry_after):
+        super().__init__('Too many login attempts')
+        self.retry_after = retry_after
+
+
+class BucketStore():
+    """Storage interface for token buckets shared by ``LoginThrottle``."""
+
+    def take(self, key, rate, capacity):
+        """Take one token from ``key``'s bucket; returns (allowed, seconds until a token is available)."""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryBucketStore(BucketStore):
+    """Per-process buckets; the least recently used are dropped past ``maxsize`` keys."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key, rate, capacity):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class RedisBucketStore(BucketStore):
+    """Buckets shared between processes through any client exposing redis-py's ``eval``."""
+
+    SCRIPT = """
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local rate, capacity, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + (now - updated) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, client, prefix='hng:bucket:'):
+        self.client = client
+        self.prefix = prefix
+
+    def take(self, key, rate, capacity):
+        allowed, tokens = self.client.eval(self.SCRIPT, 1, self.prefix + key, rate, capacity, time.time())
+        tokens = float(tokens)
+        return bool(allowed), 0 if allowed else (1 - tokens) / rate
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+
+class LoginThrottle():
+    """Token-bucket limits on login attempts per client IP and per email.
+
+    Limits are ``LOGIN_RATE_PER_IP`` / ``LOGIN_RATE_PER_EMAIL`` attempts per
+    minute, each with a burst of the same size. ``check`` runs before the user
+    lookup and password hash so rejected attempts cost neither.
+    """
+
+    def __init__(self, app=None):
+        self.store = MemoryBucketStore()
+        self.per_ip = 30
+        self.per_email = 10
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LOGIN_RATE_PER_IP', self.per_ip)
+        app.config.setdefault('LOGIN_RATE_PER_EMAIL', self.per_email)
+        app.config.setdefault('LOGIN_RATE_BACKEND', 'memory')
+        app.config.setdefault('LOGIN_RATE_REDIS_URL', None)
+        self.per_ip = int(app.config['LOGIN_RATE_PER_IP'])
+        self.per_email = int(app.config['LOGIN_RATE_PER_EMAIL'])
+        if app.config['LOGIN_RATE_BACKEND'] == 'redis':
+            import redis
+            self.store = RedisBucketStore(redis.Redis.from_url(app.config['LOGIN_RATE_REDIS_URL']))
+        else:
+            self.store = MemoryBucketStore()
+        app.extensions['login_throttle'] = self
+
+    def check(self, ip, email):
+        for scope, key, per_minute in (('ip', f'ip:{ip}', self.per_ip),
+                                       ('email', f'email:{email.strip().lower()}', self.per_email)):
+            if per_minute <= 0:
+                continue
+            allowed, retry_after = self.store.take(key, per_minute / 60, per_minute)
+            if not allowed:
+                throttled_attempts.inc(scope=scope)
+                raise RateLimited(max(1, math.ceil(retry_after)))
+
+    def reset(self):
+        self.store.clear()
+
+
+login_throttle = LoginThrottle()
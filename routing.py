@@ -0,0 +1,224 @@
+import itertools
+import math
+import threading
+import time
+
+import sqlalchemy as sa
+from flask import current_app, g, has_request_context, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from flask_jwt_extended import decode_token, get_jwt_identity
+from flask_sqlalchemy.session import Session
+from metrics import registry
+from pooling import engine_options
+
+routed_queries = registry.counter('db_session_binds_total', 'Session binds chosen per request', ('target',))
+
+READ_METHODS = ('GET', 'HEAD')
+PIN_COOKIE = 'replica_pin'
+
+# A replica that has replayed everything it received is current however old its last
+# replayed transaction is; otherwise an idle primary would make it look lagged
+REPLICA_LAG_SQL = sa.text(
+    'SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 '
+    'WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+)
+
+
+class Replica():
+
+    def __init__(self, uri):
+        self.uri = uri
+        self.engine = sa.create_engine(uri, **engine_options(uri))
+        self.checked_at = 0
+        self.healthy = True
+        sa.event.listen(self.engine, 'handle_error', self._on_error)
+
+    def _on_error(self, context):
+        if context.is_disconnect or isinstance(context.original_exception, sa.exc.OperationalError):
+            self.mark_down()
+
+    def mark_down(self):
+        self.healthy = False
+        self.checked_at = time.monotonic()
+
+    def check(self, max_lag):
+        try:
+            with self.engine.connect() as conn:
+                if self.engine.dialect.name == 'postgresql':
+                    lag = conn.execute(REPLICA_LAG_SQL).scalar() or 0
+                else:
+                    conn.execute(sa.text('SELECT 1'))
+                    lag = 0
+            self.healthy = lag <= max_lag
+        except sa.exc.SQLAlchemyError:
+            self.healthy = False
+        self.checked_at = time.monotonic()
+
+
+class ReplicaRouter():
+    """Chooses a read replica for the session bind during read-only requests.
+
+    GET/HEAD requests go round-robin to replicas that passed their last health
+    and lag check, except for users who wrote within ``REPLICA_STICKY_SECONDS``
+    (read-your-writes). Everything else, and every request when no replica is
+    healthy, uses the primary. A read that fails on a replica is retried once on
+    the primary by ``RoutingSession``.
+
+    Stickiness is kept per process and in a signed ``replica_pin`` cookie set
+    on successful writes, so it holds when the next read lands on another worker.
+    """
+
+    def __init__(self, app=None):
+        self.replicas = []
+        self.sticky_seconds = 5
+        self.max_lag = 10
+        self.check_interval = 5
+        self._cycle = None
+        self._lock = threading.Lock()
+        self._last_write = {}
+        self._signer = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('REPLICA_STICKY_SECONDS', self.sticky_seconds)
+        app.config.setdefault('REPLICA_MAX_LAG', self.max_lag)
+        app.config.setdefault('REPLICA_CHECK_INTERVAL', self.check_interval)
+        self.sticky_seconds = float(app.config['REPLICA_STICKY_SECONDS'])
+        self.max_lag = float(app.config['REPLICA_MAX_LAG'])
+        self.check_interval = float(app.config['REPLICA_CHECK_INTERVAL'])
+        self.set_replicas(app.config['SQLALCHEMY_REPLICA_URIS'])
+        self._signer = URLSafeTimedSerializer(app.secret_key, salt='replica-pin') if app.secret_key else None
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.extensions['replica_router'] = self
+
+    def set_replicas(self, uris):
+        for replica in self.replicas:
+            replica.engine.dispose()
+        self.replicas = [Replica(uri) for uri in uris]
+        self._cycle = itertools.cycle(self.replicas)
+        self._last_write.clear()
+
+    def mark_write(self, identity):
+        if identity is None:
+            return
+        now = time.monotonic()
+        if len(self._last_write) > 10000:
+            self._last_write = {key: at for key, at in self._last_write.items() if now - at < self.sticky_seconds}
+        self._last_write[identity] = now
+
+    def _before_request(self):
+        g.pop('replica', None)
+
+    def _after_request(self, response):
+        if request.method not in READ_METHODS and response.status_code < 400:
+            self.mark_write(_current_identity())
+            if self.replicas and self._signer is not None and self.sticky_seconds > 0:
+                response.set_cookie(PIN_COOKIE, self._signer.dumps(1), max_age=math.ceil(self.sticky_seconds),
+                                    secure=request.is_secure, httponly=True, samesite='Lax')
+        return response
+
+    def _pinned(self):
+        pin = request.cookies.get(PIN_COOKIE)
+        if pin is None or self._signer is None:
+            return False
+        try:
+            self._signer.loads(pin, max_age=self.sticky_seconds)
+        except BadSignature:
+            return False
+        return True
+
+    def _sticky(self):
+        written = self._last_write.get(_current_identity())
+        if written is not None and time.monotonic() - written < self.sticky_seconds:
+            return True
+        return self._pinned()
+
+    def choose(self):
+        """The replica engine to read from, or ``None`` for the primary."""
+        if not self.replicas or not has_request_context() or request.method not in READ_METHODS:
+            return None
+        if 'replica' not in g:
+            g.replica = self._pick() if not self._sticky() else None
+            routed_queries.inc(target='replica' if g.replica is not None else 'primary')
+        return g.replica
+
+    def fall_back(self):
+        """Send the rest of this request to the primary; False if it was not on a replica."""
+        if not has_request_context() or g.get('replica') is None:
+            return False
+        for replica in self.replicas:
+            if replica.engine is g.replica:
+                replica.mark_down()
+        g.replica = None
+        routed_queries.inc(target='fallback')
+        return True
+
+    def _pick(self):
+        now = time.monotonic()
+        for _ in range(len(self.replicas)):
+            with self._lock:
+                replica = next(self._cycle)
+                due = now - replica.checked_at >= self.check_interval
+                if due:
+                    # Claimed under the lock, checked outside it: a replica that is slow to
+                    # connect holds up this request only, others use its last result meanwhile
+                    replica.checked_at = now
+            if due:
+                replica.check(self.max_lag)
+            if replica.healthy:
+                return replica.engine
+        return None
+
+
+def _current_identity():
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        pass
+    # The first queries of a request (the JWT user lookup and blocklist check) run before
+    # flask_jwt_extended records the verified token, so decode it here; decodes are cached
+    header = request.headers.get('Authorization', '') if has_request_context() else ''
+    if not header.startswith('Bearer '):
+        return None
+    try:
+        claims = decode_token(header[len('Bearer '):])
+    except Exception:
+        return None
+    return claims.get(current_app.config['JWT_IDENTITY_CLAIM'])
+
+
+replica_router = ReplicaRouter()
+
+
+class RoutingSession(Session):
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            replica = replica_router.choose()
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _with_fallback(self, method, *args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except sa.exc.OperationalError:
+            # The replica went away since its last check; mark it down and retry this
+            # read-only request on the primary
+            if not replica_router.fall_back():
+                raise
+            self.rollback()
+            return method(*args, **kwargs)
+
+    def execute(self, *args, **kwargs):
+        return self._with_fallback(super().execute, *args, **kwargs)
+
+    def scalar(self, *args, **kwargs):
+        return self._with_fallback(super().scalar, *args, **kwargs)
+
+    def scalars(self, *args, **kwargs):
+        return self._with_fallback(super().scalars, *args, **kwargs)
@@ -0,0 +1,119 @@
+from sqlalchemy import case, column, func, literal, literal_column, select, table
+from models import db, user_organisation, Organisation
+
+organisation_fts = table('organisation_fts', column('rowid'), column('name'))
+
+
+def trigrams(text):
+    """Lower-cased three-character substrings, as SQLite's FTS5 trigram tokenizer indexes them."""
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def similarity(query, name):
+    """Share of the query's trigrams found in ``name``; like pg_trgm's word_similarity."""
+    wanted = trigrams(query)
+    if not wanted:
+        return 0.0
+    return len(wanted & trigrams(name)) / len(wanted)
+
+
+def escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class OrganisationSearch():
+    """Prefix and fuzzy name search over the organisations one user belongs to.
+
+    PostgreSQL ranks in SQL with pg_trgm's ``<%`` word similarity, served by the
+    ``ix_organisation_name_trgm`` GIN index. SQLite pulls trigram candidates
+    from the ``organisation_fts`` FTS5 table and ranks them here with the same
+    measure. Prefix matches sort first; fuzzy matches need ``threshold``
+    similarity, which on PostgreSQL is set as ``pg_trgm.word_similarity_threshold``
+    for the transaction so ``<%`` applies it.
+
+    Queries shorter than a trigram are a plain prefix match. Other dialects, and
+    SQLite callers with at most ``scan_limit`` memberships, are ranked in Python
+    straight off the membership index. Every query is scoped to the caller's
+    ``user_organisation`` rows.
+    """
+
+    @staticmethod
+    def scoped_query(user_id):
+        return (
+            select(Organisation.orgId, Organisation.name, Organisation.description)
+            .join(user_organisation, user_organisation.c.organisation_id == Organisation.orgId)
+            .where(user_organisation.c.user_id == user_id)
+        )
+
+    @staticmethod
+    def prefix_query(user_id, q, limit):
+        return (
+            OrganisationSearch.scoped_query(user_id)
+            .where(Organisation.name.ilike(escape_like(q) + '%', escape='\\'))
+            .order_by(Organisation.name, Organisation.orgId)
+            .limit(limit)
+        )
+
+    @staticmethod
+    def threshold_statement(threshold):
+        """Transaction-local ``pg_trgm.word_similarity_threshold``, the cut-off ``<%`` applies."""
+        return select(func.set_config('pg_trgm.word_similarity_threshold', str(threshold), True))
+
+    @staticmethod
+    def postgresql_query(user_id, q, limit):
+        prefix = Organisation.name.ilike(escape_like(q) + '%', escape='\\')
+        return (
+            OrganisationSearch.scoped_query(user_id)
+            .where(prefix | literal(q).op('<%')(Organisation.name))
+            .order_by(case((prefix, 0), else_=1), func.word_similarity(q, Organisation.name).desc(), Organisation.orgId)
+            .limit(limit)
+        )
+
+    @staticmethod
+    def sqlite_query(user_id, q):
+        match = ' OR '.join('"{}"'.format(trigram.replace('"', '""')) for trigram in sorted(trigrams(q)))
+        # Materialised so the FTS lookup runs once, rather than once per membership row
+        matches = (
+            select(organisation_fts.c.rowid)
+            .where(organisation_fts.c.name.op('MATCH')(match))
+            .cte('matches')
+            .prefix_with('MATERIALIZED')
+        )
+        return (
+            OrganisationSearch.scoped_query(user_id)
+            .join(matches, matches.c.rowid == literal_column('organisation.rowid'))
+        )
+
+    @staticmethod
+    def rank(q, rows, limit, threshold):
+        prefix = q.lower()
+        scored = []
+        for row in rows:
+            is_prefix = row.name.lower().startswith(prefix)
+            score = similarity(q, row.name)
+            if is_prefix or score >= threshold:
+                scored.append((not is_prefix, -score, row.orgId, row))
+        scored.sort(key=lambda item: item[:3])
+        return [item[-1] for item in scored[:limit]]
+
+    @staticmethod
+    def membership_count_query(user_id):
+        return select(func.count()).select_from(user_organisation).where(user_organisation.c.user_id == user_id)
+
+    @staticmethod
+    def search(user_id, q, limit=20, threshold=0.6, scan_limit=10000):
+        """Best matches first; SQLite ranks callers with at most ``scan_limit`` memberships without FTS."""
+        dialect = db.session.get_bind().dialect.name
+        if len(q) < 3:
+            return db.session.execute(OrganisationSearch.prefix_query(user_id, q, limit)).all()
+        if dialect == 'postgresql':
+            db.session.execute(OrganisationSearch.threshold_statement(threshold))
+            return db.session.execute(OrganisationSearch.postgresql_query(user_id, q, limit)).all()
+        # SQLite's planner cannot weigh the FTS side against the membership side, so choose here:
+        # common trigrams can match a large share of the table, while most callers belong to few organisations
+        if dialect == 'sqlite' and db.session.execute(OrganisationSearch.membership_count_query(user_id)).scalar() > scan_limit:
+            rows = db.session.execute(OrganisationSearch.sqlite_query(user_id, q))
+        else:
+            rows = db.session.execute(OrganisationSearch.scoped_query(user_id))
+        return OrganisationSearch.rank(q, rows, limit, threshold)
@@ -0,0 +1,57 @@
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib fallback
+    orjson = None
+
+
+def user_to_dict(user):
+    return {
+        "userId": user.userId,
+        "firstName": user.firstName,
+        "lastName": user.lastName,
+        "email": user.email,
+        "phone": user.phone
+    }
+
+
+def organisation_to_dict(organisation):
+    """Works for Organisation instances and (orgId, name, description) result rows alike."""
+    return {
+        "orgId": organisation.orgId,
+        "name": organisation.name,
+        "description": organisation.description
+    }
+
+
+def dumps_bytes(obj):
+    """Compact UTF-8 JSON, through orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=DefaultJSONProvider.default)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=DefaultJSONProvider.default).encode()
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes with orjson; falls back to the default provider without it."""
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs.get('cls') or kwargs.get('indent'):
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_SORT_KEYS if kwargs.get('sort_keys', self.sort_keys) else 0
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if orjson is None or (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(obj)
+        option = orjson.OPT_APPEND_NEWLINE | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+        body = orjson.dumps(obj, default=self.default, option=option)
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -0,0 +1,150 @@
+import zlib
+
+from pagination import encode_cursor
+from serializers import dumps_bytes
+
+
+class KeysetStream():
+    """Batches of rows from a ``yield_per`` result, cut off after ``limit`` rows.
+
+    The query should ask for ``limit + 1`` rows; once iteration is done,
+    ``next_cursor`` is set if that extra row showed up. ``limit = None``
+    streams everything.
+    """
+
+    def __init__(self, result, limit, key):
+        self.result = result
+        self.limit = limit
+        self.key = key
+        self.next_cursor = None
+        self._emitted = 0
+        self._last = None
+
+    def _take(self, batch):
+        """The part of ``batch`` to send, and whether the limit has been reached."""
+        if self.limit is not None and self._emitted + len(batch) > self.limit:
+            batch = batch[:self.limit - self._emitted]
+            if batch:
+                self._last = batch[-1]
+            self.next_cursor = encode_cursor(self.key(self._last))
+            return batch, True
+        self._emitted += len(batch)
+        self._last = batch[-1]
+        return batch, False
+
+    def __iter__(self):
+        try:
+            for batch in self.result.partitions():
+                batch, done = self._take(batch)
+                if batch:
+                    yield batch
+                if done:
+                    return
+        finally:
+            # Also runs when the client goes away mid-stream, releasing the server-side cursor
+            self.result.close()
+
+
+class AsyncKeysetStream(KeysetStream):
+    """``KeysetStream`` over an ``AsyncResult`` from ``AsyncSession.stream``."""
+
+    async def __aiter__(self):
+        try:
+            async for batch in self.result.partitions():
+                batch, done = self._take(batch)
+                if batch:
+                    yield batch
+                if done:
+                    return
+        finally:
+            await self.result.close()
+
+
+class NDJSONBody():
+    """One JSON object per line; a final ``{"nextCursor": ...}`` line when there are more rows."""
+
+    def __init__(self, to_dict):
+        self.to_dict = to_dict
+
+    def head(self):
+        return b''
+
+    def batch(self, rows):
+        return b''.join(dumps_bytes(self.to_dict(row)) + b'\n' for row in rows)
+
+    def tail(self, next_cursor):
+        return dumps_bytes({"nextCursor": next_cursor}) + b'\n' if next_cursor else b''
+
+
+class JSONBody():
+    """``envelope`` with ``data[field]`` streamed as a JSON array and ``data.nextCursor`` after it."""
+
+    def __init__(self, to_dict, envelope, field):
+        self.to_dict = to_dict
+        head = dumps_bytes(dict(envelope, data={field: []}))
+        # Split the serialized envelope at the empty array so items can be written in between
+        self.opening = head[:head.rindex(b'[]') + 1]
+        self.separator = b''
+
+    def head(self):
+        return self.opening
+
+    def batch(self, rows):
+        chunk = self.separator + b','.join(dumps_bytes(self.to_dict(row)) for row in rows)
+        self.separator = b','
+        return chunk
+
+    def tail(self, next_cursor):
+        return b'],"nextCursor":' + dumps_bytes(next_cursor) + b'}}'
+
+
+def body(stream, fmt):
+    """Encode a ``KeysetStream`` with an ``NDJSONBody`` or ``JSONBody``, one chunk per batch."""
+    head = fmt.head()
+    if head:
+        yield head
+    for batch in stream:
+        yield fmt.batch(batch)
+    tail = fmt.tail(stream.next_cursor)
+    if tail:
+        yield tail
+
+
+async def async_body(stream, fmt):
+    """``body`` for an ``AsyncKeysetStream``."""
+    head = fmt.head()
+    if head:
+        yield head
+    async for batch in stream:
+        yield fmt.batch(batch)
+    tail = fmt.tail(stream.next_cursor)
+    if tail:
+        yield tail
+
+
+def ndjson_body(stream, to_dict):
+    return body(stream, NDJSONBody(to_dict))
+
+
+def json_body(stream, to_dict, envelope, field):
+    return body(stream, JSONBody(to_dict, envelope, field))
+
+
+def gzip_body(chunks, level=6):
+    """gzip a chunk stream, flushing after every chunk so clients can decode as data arrives."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def async_gzip_body(chunks, level=6):
+    """``gzip_body`` for an async chunk stream."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import unittest
+from unittest import mock
+from models import db
+from ratelimit import login_throttle
+from hashing import hasher
+from tokens import token_state
+from cache import model_cache
+from sqlalchemy.exc import OperationalError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+try:
+    from starlette.testclient import TestClient
+    import asgi
+except ImportError:
+    asgi = None
+
+@unittest.skipIf(asgi is None, 'async serving mode dependencies are not installed')
+class AsgiTestCase(unittest.TestCase):
+
+    def setUp(self):
+        asyncio.run(self.run_sync(db.metadata.create_all))
+        self.client = TestClient(asgi.application)
+
+    def tearDown(self):
+        self.client.close()
+        asyncio.run(self.run_sync(db.metadata.drop_all))
+
+    async def run_sync(self, fn):
+        async with asgi.engine.begin() as conn:
+            await conn.run_sync(fn)
+
+    def register(self, email='john.doe@example.com', first_name='John'):
+        response = self.client.post('/auth/register', json={
+            'firstName': first_name,
+            'lastName': 'Doe',
+            'email': email,
+            'password': 'password123',
+            'phone': '1234567890'
+        })
+        self.assertEqual(response.status_code, 201)
+        return response.json()['data']
+
+    def test_register_and_login(self):
+        self.register()
+        response = self.client.post('/auth/login', json={'email': 'john.doe@example.com', 'password': 'password123'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('accessToken', response.json()['data'])
+
+        response = self.client.post('/auth/login', json={'email': 'john.doe@example.com', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 401)
+
+        with mock.patch.object(hasher, 'check_dummy', wraps=hasher.check_dummy) as check_dummy:
+            response = self.client.post('/auth/login', json={'email': 'nobody@example.com', 'password': 'password123'})
+        self.assertEqual(response.status_code, 401)
+        check_dummy.assert_called_once_with('password123')
+
+    def test_login_survives_failed_rehash(self):
+        user_id = self.register()['user']['userId']
+        failing_commit = mock.patch('sqlalchemy.ext.asyncio.AsyncSession.commit', side_effect=OperationalError('UPDATE', {}, Exception('locked')))
+        with mock.patch.object(hasher, 'needs_rehash', return_value=True), failing_commit, \
+                mock.patch.object(model_cache, 'invalidate_user') as invalidate_user:
+            response = self.client.post('/auth/login', json={'email': 'john.doe@example.com', 'password': 'password123'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['user']['userId'], user_id)
+        invalidate_user.assert_not_called()
+
+        with mock.patch.object(hasher, 'needs_rehash', return_value=True), \
+                mock.patch.object(model_cache, 'invalidate_user') as invalidate_user:
+            response = self.client.post('/auth/login', json={'email': 'john.doe@example.com', 'password': 'password123'})
+        self.assertEqual(response.status_code, 200)
+        invalidate_user.assert_called_once_with(user_id)
+
+    def test_login_throttled(self):
+        self.addCleanup(login_throttle.reset)
+        login_throttle.reset()
+        for _ in range(login_throttle.per_email):
+            response = self.client.post('/auth/login', json={'email': 'target@example.com', 'password': 'guess'})
+            self.assertEqual(response.status_code, 401)
+        response = self.client.post('/auth/login', json={'email': 'target@example.com', 'password': 'guess'})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+
+        response = self.client.post('/auth/login', json={'email': 5, 'password': 'guess'})
+        self.assertEqual(response.status_code, 401)
+
+    def test_register_validation_and_duplicate(self):
+        response = self.client.post('/auth/register', json={'firstName': 'John'})
+        self.assertEqual(response.status_code, 422)
+        self.register()
+        response = self.client.post('/auth/register', json={'firstName': 'Jane', 'lastName': 'Doe', 'email': 'john.doe@example.com', 'password': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_organisation_routes(self):
+        owner = self.register()
+        other = self.register('jane.doe@example.com', 'Jane')
+        headers = {'Authorization': f"Bearer {owner['accessToken']}"}
+
+        response = self.client.get('/api/organisations', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['organisations'][0]['name'], "John's Organisation")
+
+        response = self.client.post('/api/organisations', json={'name': 'Async Organisation'}, headers=headers)
+        self.assertEqual(response.status_code, 201)
+        org_id = response.json()['data']['orgId']
+
+        other_id = other['user']['userId']
+        self.assertEqual(self.client.get(f'/api/users/{other_id}', headers=headers).status_code, 403)
+        response = self.client.post(f'/api/organisations/{org_id}/users', json={'userId': other_id}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(f'/api/users/{other_id}', headers=headers).status_code, 200)
+        self.assertEqual(self.client.get(f'/api/organisations/{org_id}', headers={'Authorization': f"Bearer {other['accessToken']}"}).status_code, 200)
+
+    def test_writes_invalidate_model_cache(self):
+        owner = self.register()
+        other = self.register('jane.doe@example.com', 'Jane')
+        headers = {'Authorization': f"Bearer {owner['accessToken']}"}
+        owner_id, other_id = owner['user']['userId'], other['user']['userId']
+
+        with mock.patch.object(model_cache, 'invalidate_user') as invalidate_user, \
+                mock.patch.object(model_cache, 'invalidate_organisation') as invalidate_organisation:
+            org_id = self.client.post('/api/organisations', json={'name': 'Cached'}, headers=headers).json()['data']['orgId']
+            self.client.post(f'/api/organisations/{org_id}/users', json={'userId': other_id}, headers=headers)
+            self.client.post(f'/api/organisations/{org_id}/users', json={'userIds': [other_id, 'missing']}, headers=headers)
+        self.assertEqual(invalidate_user.call_args_list, [mock.call(owner_id), mock.call(other_id)])
+        self.assertEqual(invalidate_organisation.call_args_list, [mock.call(org_id)] * 3)
+
+    def test_read_routes_match_flask_app(self):
+        owner = self.register()
+        other = self.register('jane.doe@example.com', 'Jane')
+        headers = {'Authorization': f"Bearer {owner['accessToken']}"}
+        org_id = self.client.post('/api/organisations', json={'name': 'Async Rockets'}, headers=headers).json()['data']['orgId']
+        self.client.post(f'/api/organisations/{org_id}/users', json={'userId': other['user']['userId']}, headers=headers)
+
+        response = self.client.get(f'/api/organisations/{org_id}', headers=headers)
+        etag = response.headers['ETag']
+        response = self.client.get(f'/api/organisations/{org_id}', headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get('/api/organisations/search', params={'q': 'rocket'}, headers=headers)
+        self.assertEqual([org['orgId'] for org in response.json()['data']['organisations']], [org_id])
+
+        response = self.client.get(f"/api/users?ids={other['user']['userId']},nobody", headers=headers)
+        self.assertEqual([item['status'] for item in response.json()['data']['users']], ['found', 'missing'])
+
+        response = self.client.get(f'/api/organisations/{org_id}/users', params={'limit': 1}, headers=headers)
+        data = response.json()['data']
+        self.assertEqual(len(data['users']), 1)
+        self.assertIsNotNone(data['nextCursor'])
+        response = self.client.get(f'/api/organisations/{org_id}/users', params={'format': 'ndjson'},
+                                   headers=dict(headers, **{'Accept-Encoding': 'gzip'}))
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        lines = response.text.splitlines()
+        self.assertEqual(sorted(json.loads(line)['email'] for line in lines), ['jane.doe@example.com', 'john.doe@example.com'])
+
+    def test_missing_and_invalid_token(self):
+        self.assertEqual(self.client.get('/api/organisations').json(), {'message': 'Missing JWT token'})
+        response = self.client.get('/api/organisations', headers={'Authorization': 'Bearer invalid_token'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {'message': 'Invalid JWT token'})
+
+    def test_logout_revokes_tokens(self):
+        asgi.flask_app.config['JWT_STATELESS'] = True
+        self.addCleanup(asgi.flask_app.config.__setitem__, 'JWT_STATELESS', False)
+        self.addCleanup(token_state.cache.clear)
+        headers = {'Authorization': f"Bearer {self.register()['accessToken']}"}
+        self.assertEqual(self.client.get('/api/organisations', headers=headers).status_code, 200)
+
+        response = self.client.post('/auth/logout', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['message'], 'Logout successful')
+        response = self.client.get('/api/organisations', headers=headers)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {'message': 'Token has been revoked'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,63 @@
 import os
+import tempfile
+import threading
 import unittest
+from unittest import mock
 from app import app, db
-from models import User
+from hashing import hasher, HashingBusy, queue_depth, hash_rejected, default_workers, pool_context
+from ratelimit import login_throttle
+from emailfilter import email_filter, filter_lookups, RedisBitStore
+from instrumentation import QueryCounter
+from flask_jwt_extended import create_access_token
+from models import User, Organisation
 from dotenv import load_dotenv
 from flask import current_app
+from sqlalchemy.exc import OperationalError
 
 load_dotenv()
 
+class FakeRedis():
+    """Just the redis-py calls RedisBitStore makes, kept in a dict."""
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def setbit(self, key, position, value):
+        self.data.setdefault(key, set()).add(position)
+
+    def getbit(self, key, position):
+        return int(position in self.data.get(key, ()))
+
+
+class FakePipeline():
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append((getattr(self.client, name), args))
+
+    def execute(self):
+        return [fn(*args) for fn, args in self.calls]
+
+
 class AuthTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -72,6 +123,8 @@ class AuthTestCase(unittest.TestCase):
             'phone': '0987654321'
         })
         self.assertEqual(response.status_code, 400)
+        self.assertEqual(User.query.count(), 1)
+        self.assertEqual(Organisation.query.count(), 1)
 
     def test_login_user_success(self):
         self.app.post('/auth/register', json={
@@ -98,5 +151,275 @@ class AuthTestCase(unittest.TestCase):
         })
         self.assertEqual(response.status_code, 401)
 
+    def test_login_user_hashing_busy(self):
+        self.app.post('/auth/register', json={
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'email': 'john.doe@example.com',
+            'password': 'password123',
+            'phone': '1234567890'
+        })
+        with mock.patch.object(hasher, 'check', side_effect=HashingBusy(2)):
+            response = self.app.post('/auth/login', json={
+                'email': 'john.doe@example.com',
+                'password': 'password123'
+            })
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '2')
+        self.assertEqual(response.get_json()['statusCode'], 503)
+
+    def test_login_rejected_when_hash_slots_are_full(self):
+        self.register_john()
+        saved = {key: app.config[key] for key in ('HASH_WORKERS', 'HASH_QUEUE_SIZE', 'HASH_RETRY_AFTER')}
+        self.addCleanup(hasher.init_app, app)
+        self.addCleanup(app.config.update, saved)
+        # Hash inline with a single slot, so one blocked job fills the pool
+        app.config.update(HASH_WORKERS=0, HASH_QUEUE_SIZE=0, HASH_RETRY_AFTER=3)
+        hasher.init_app(app)
+
+        started, release = threading.Event(), threading.Event()
+        def blocking_check(pwhash, password):
+            started.set()
+            release.wait(10)
+            return False
+        with mock.patch('hashing.check_password_hash', blocking_check):
+            worker = threading.Thread(target=hasher.check, args=('hash', 'password'))
+            worker.start()
+            self.addCleanup(worker.join)
+            self.addCleanup(release.set)
+            self.assertTrue(started.wait(10))
+            self.assertEqual(queue_depth.value(), 1)
+            rejected = hash_rejected.value()
+
+            response = self.app.post('/auth/login', json={'email': 'john.doe@example.com', 'password': 'password'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '3')
+        self.assertEqual(response.get_json()['statusCode'], 503)
+        self.assertEqual(hash_rejected.value(), rejected + 1)
+
+    def test_hash_inline_on_vercel(self):
+        self.assertEqual(default_workers({'VERCEL': '1'}), 0)
+        self.assertGreaterEqual(default_workers({}), 1)
+        self.assertNotEqual(pool_context().get_start_method(), 'fork')
+
+    def test_login_upgrades_stale_hash(self):
+        self.app.post('/auth/register', json={
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'email': 'john.doe@example.com',
+            'password': 'password123',
+            'phone': '1234567890'
+        })
+        with mock.patch.object(hasher, 'method', 'pbkdf2:sha256:1000'):
+            response = self.app.post('/auth/login', json={
+                'email': 'john.doe@example.com',
+                'password': 'password123'
+            })
+        self.assertEqual(response.status_code, 200)
+        user = User.query.filter_by(email='john.doe@example.com').first()
+        self.assertTrue(user.password.startswith('pbkdf2:sha256:1000$'))
+
+    def test_import_users_endpoint(self):
+        admin = User(userId='admin', firstName='Ada', lastName='Admin', email='admin@example.com', password='password123')
+        db.session.add(admin)
+        db.session.commit()
+        app.config['ADMIN_USER_IDS'] = {'admin'}
+        self.addCleanup(app.config.__setitem__, 'ADMIN_USER_IDS', set())
+        token = create_access_token(identity='admin')
+
+        body = '\n'.join([
+            '{"firstName": "John", "lastName": "Doe", "email": "john.doe@example.com", "password": "password123"}',
+            '{"firstName": "Jane", "lastName": "Doe", "email": "admin@example.com", "password": "password123"}',
+            '{"firstName": "Jack", "email": "jack@example.com", "password": "password123"}',
+            'not json',
+            '{"firstName": "Jill", "lastName": "Hill", "email": "jill@example.com", "password": "password123"}',
+            '{"firstName": "Joe", "lastName": "Bloggs", "email": "joe@example.com", "password": 12345}',
+        ])
+        response = self.app.post('/admin/users/import', data=body, content_type='application/x-ndjson', headers={'Authorization': f'Bearer {token}'})
+        data = response.get_json()['data']
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((data['imported'], data['failed']), (2, 4))
+        self.assertEqual(sorted(error['row'] for error in data['errors']), [2, 3, 4, 6])
+        self.assertIn({'field': 'password', 'message': 'password must be a string'},
+                      next(error for error in data['errors'] if error['row'] == 6)['errors'])
+
+        login = self.app.post('/auth/login', json={'email': 'jill@example.com', 'password': 'password123'})
+        self.assertEqual(login.status_code, 200)
+        jill = User.query.filter_by(email='jill@example.com').first()
+        self.assertEqual(jill.organisations[0].name, "Jill's Organisation")
+
+    def test_import_users_requires_admin(self):
+        self.app.post('/auth/register', json={
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'email': 'john.doe@example.com',
+            'password': 'password123'
+        })
+        user = User.query.filter_by(email='john.doe@example.com').first()
+        token = create_access_token(identity=user.userId)
+        response = self.app.post('/admin/users/import', data='', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_import_users_command(self):
+        fd, source = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as f:
+            f.write('firstName,lastName,email,password,phone\n')
+            f.write('John,Doe,john.doe@example.com,password123,123\n')
+            f.write('Jane,Doe,jane.doe@example.com,password123,\n')
+        self.addCleanup(os.remove, source)
+
+        result = app.test_cli_runner().invoke(args=['import-users', source])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('imported 2 users', result.output)
+        self.assertEqual(User.query.count(), 2)
+
+    def test_login_throttled_per_email(self):
+        self.addCleanup(login_throttle.reset)
+        login_throttle.reset()
+        with mock.patch.object(hasher, 'check') as check:
+            for _ in range(login_throttle.per_email):
+                response = self.app.post('/auth/login', json={'email': 'target@example.com', 'password': 'guess'})
+                self.assertEqual(response.status_code, 401)
+            check.reset_mock()
+            response = self.app.post('/auth/login', json={'email': 'Target@example.com', 'password': 'guess'})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+        check.assert_not_called()
+
+        response = self.app.post('/auth/login', json={'email': 'other@example.com', 'password': 'guess'})
+        self.assertEqual(response.status_code, 401)
+
+    def test_login_rejects_non_string_credentials(self):
+        for body in ({'email': 5, 'password': 'x'}, {'email': 'john.doe@example.com', 'password': ['x']}):
+            response = self.app.post('/auth/login', json=body)
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response.get_json()['message'], 'Authentication failed')
+
+    def test_failed_query_leaves_no_timing_state(self):
+        with db.engine.connect() as conn:
+            with self.assertRaises(OperationalError):
+                conn.exec_driver_sql('SELECT * FROM missing_table')
+            self.assertNotIn('query_started', conn.info)
+            self.assertEqual(conn.exec_driver_sql('SELECT 1').scalar(), 1)
+
+    def test_metrics_endpoint(self):
+        self.register_john()
+        self.app.post('/auth/login', json={'email': 'john.doe@example.com', 'password': 'password'})
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        body = response.get_data(as_text=True)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_requests_total{route="login_user",method="POST",status="200"}', body)
+        self.assertIn('db_queries_per_request_count{route="register_user"}', body)
+        self.assertIn('password_hash_seconds_count{op="check"}', body)
+
+        app.config['METRICS_TOKEN'] = 'scrape-secret'
+        self.addCleanup(app.config.__setitem__, 'METRICS_TOKEN', None)
+        self.assertEqual(self.app.get('/metrics').status_code, 401)
+        response = self.app.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_query_budgets(self):
+        # Raise a budget only together with the change that needs the extra query
+        with QueryCounter(budget=4):
+            self.assertEqual(self.register_john().status_code, 201)
+        db.session.remove()
+        with QueryCounter(budget=1):
+            response = self.app.post('/auth/login', json={'email': 'john.doe@example.com', 'password': 'password'})
+            self.assertEqual(response.status_code, 200)
+
+    def register_john(self):
+        return self.app.post('/auth/register', json={
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'email': 'john.doe@example.com',
+            'password': 'password'
+        })
+
+    def enable_email_filter(self, store=None, load=True):
+        app.config['EMAIL_FILTER'] = True
+        email_filter.init_app(app)
+        if store is not None:
+            email_filter.store = store
+        self.addCleanup(email_filter.init_app, app)
+        self.addCleanup(app.config.__setitem__, 'EMAIL_FILTER', False)
+        self.addCleanup(email_filter.wait_loaded)
+        if load:
+            email_filter.start_load()
+            email_filter.wait_loaded()
+
+    def test_email_filter_short_circuits_unknown_login(self):
+        self.register_john()
+        self.enable_email_filter(RedisBitStore(FakeRedis()))
+        absent = filter_lookups.value(result='absent')
+        with mock.patch.object(hasher, 'check_dummy', wraps=hasher.check_dummy) as check_dummy:
+            response = self.app.post('/auth/login', json={'email': 'nobody@example.com', 'password': 'password'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(filter_lookups.value(result='absent'), absent + 1)
+        check_dummy.assert_called_once_with('password')
+
+        response = self.app.post('/auth/login', json={'email': 'john.doe@example.com', 'password': 'password'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_email_filter_incomplete_load_falls_through(self):
+        redis = FakeRedis()
+        # Another worker holds the load, and has not set any bits yet
+        redis.set('hng:email-filter:loading', 1)
+        self.enable_email_filter(RedisBitStore(redis), load=False)
+        email_filter.retry_interval = 0
+        self.register_john()
+        redis.delete('hng:email-filter')
+        loading = filter_lookups.value(result='loading')
+        response = self.app.post('/auth/login', json={'email': 'john.doe@example.com', 'password': 'password'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(filter_lookups.value(result='loading'), loading + 1)
+
+        # That worker died; once its claim expires the next lookup starts a load here,
+        # and is answered from the database while it runs
+        email_filter.wait_loaded()
+        redis.delete('hng:email-filter:loading')
+        response = self.app.post('/auth/login', json={'email': 'john.doe@example.com', 'password': 'password'})
+        self.assertEqual(response.status_code, 200)
+        email_filter.wait_loaded()
+        self.assertTrue(redis.exists('hng:email-filter:complete'))
+        self.assertFalse(email_filter.might_contain('nobody@example.com', authoritative=True))
+
+    def test_email_filter_loads_in_background(self):
+        self.register_john()
+        release = threading.Event()
+        load = email_filter.load
+        def slow_load():
+            release.wait(10)
+            load()
+        self.enable_email_filter(load=False)
+        with mock.patch.object(email_filter, 'load', slow_load):
+            # Answered at once while the load is still running, and the database has the final say
+            self.assertTrue(email_filter.might_contain('nobody@example.com'))
+            response = self.app.post('/auth/register', json={'firstName': 'John', 'lastName': 'Doe', 'email': 'john.doe@example.com', 'password': 'password'})
+            self.assertEqual(response.status_code, 400)
+            release.set()
+            email_filter.wait_loaded()
+        self.assertFalse(email_filter.might_contain('nobody@example.com'))
+
+    def test_email_filter_memory_backend_does_not_refuse_login(self):
+        self.enable_email_filter()
+        self.assertFalse(email_filter.might_contain('jane.doe@example.com'))
+        # Registered through another worker, whose filter this process never saw
+        db.session.add(User(userId='elsewhere', firstName='Jane', lastName='Doe', email='jane.doe@example.com',
+                            password=hasher.generate('password')))
+        db.session.commit()
+        response = self.app.post('/auth/login', json={'email': 'jane.doe@example.com', 'password': 'password'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_email_filter_rejects_duplicate_before_hashing(self):
+        self.enable_email_filter()
+        self.register_john()
+        with mock.patch.object(hasher, 'generate') as generate:
+            response = self.register_john()
+        self.assertEqual(response.status_code, 400)
+        generate.assert_not_called()
+        self.assertEqual(User.query.count(), 1)
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,17 @@
+import gzip
+import json
 import os
+import tempfile
 import unittest
-from app import app, db
-from models import User, Organisation
+from unittest import mock
+from app import app, db, jwt
+from models import User, Organisation, TokenVersion
+from membership import Membership
+from cache import model_cache
+from routing import replica_router
+from tokens import token_state, decode_cache_requests
+from instrumentation import QueryCounter
+from models import user_organisation
 from flask_jwt_extended import create_access_token
 from dotenv import load_dotenv
 from flask import current_app
@@ -39,6 +49,26 @@ class OrganisationTestCase(unittest.TestCase):
         # Pop the application context
         self.app_context.pop()
 
+    def test_query_budgets(self):
+        # Raise a budget only together with the change that needs the extra query
+        headers = {'Authorization': f'Bearer {self.access_token}'}
+        newcomer = User(userId='newcomer', firstName='New', lastName='Comer', email='new@example.com', password='password123')
+        db.session.add(newcomer)
+        db.session.commit()
+        budgets = [
+            ('get_user self', 1, lambda: self.app.get('/api/users/testuser', headers=headers)),
+            ('get_user other', 3, lambda: self.app.get('/api/users/anotheruser', headers=headers)),
+            ('get_users', 2, lambda: self.app.get('/api/users?ids=testuser,anotheruser,newcomer', headers=headers)),
+            ('get_organisations', 2, lambda: self.app.get('/api/organisations', headers=headers)),
+            ('get_organisation', 3, lambda: self.app.get('/api/organisations/testorg', headers=headers)),
+            ('create_organisation', 5, lambda: self.app.post('/api/organisations', json={'name': 'Budget'}, headers=headers)),
+            ('add_user_to_organisation', 7, lambda: self.app.post('/api/organisations/testorg/users', json={'userId': 'newcomer'}, headers=headers)),
+        ]
+        for route, budget, call in budgets:
+            db.session.remove()
+            with self.subTest(route=route), QueryCounter(budget=budget):
+                self.assertLess(call().status_code, 300)
+
     def test_get_user_success(self):
         response = self.app.get(f'/api/users/{self.another_user.userId}', headers={'Authorization': f'Bearer {self.access_token}'})
         data = response.get_json()
@@ -74,6 +104,25 @@ class OrganisationTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 403)
         self.assertEqual(data['message'], 'You do not have permission to view this user')
 
+    def test_get_users_batch(self):
+        stranger = User(userId='stranger', firstName='Jack', lastName='Smith', email='jack.smith@example.com', password='password123')
+        db.session.add(stranger)
+        db.session.commit()
+
+        response = self.app.get('/api/users?ids=anotheruser,nobody,stranger&ids=testuser,anotheruser', headers={'Authorization': f'Bearer {self.access_token}'})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(item['userId'], item['status']) for item in data['data']['users']],
+                         [('anotheruser', 'found'), ('nobody', 'missing'), ('stranger', 'forbidden'), ('testuser', 'found')])
+        self.assertEqual(data['data']['users'][0]['user']['email'], 'mark.hng@example.com')
+        self.assertNotIn('user', data['data']['users'][2])
+
+        response = self.app.get('/api/users', headers={'Authorization': f'Bearer {self.access_token}'})
+        self.assertEqual(response.status_code, 400)
+        with mock.patch.dict(app.config, {'MAX_BATCH_USERS': 2}):
+            response = self.app.get('/api/users?ids=a,b,c', headers={'Authorization': f'Bearer {self.access_token}'})
+        self.assertEqual(response.status_code, 400)
+
     def test_get_organisations(self):
         response = self.app.get('/api/organisations', headers={'Authorization': f'Bearer {self.access_token}'})
         data = response.get_json()
@@ -99,6 +148,7 @@ class OrganisationTestCase(unittest.TestCase):
         response = self.app.post('/api/organisations/testorg/users', json={'userId': 'newuser'}, headers={'Authorization': f'Bearer {self.access_token}'})
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.get_json()['message'], 'User added to organisation successfully')
+        self.assertTrue(Membership.is_member('newuser', 'testorg'))
 
     def test_add_user_to_organisation_unauthorized(self):
         new_user = User(userId='newuser', firstName='Jane', lastName='Doe', email='jane.doe@example.com', password='password123', phone='0987654321')
@@ -117,5 +167,410 @@ class OrganisationTestCase(unittest.TestCase):
         response = self.app.get('/api/organisations/testorg', headers={'Authorization': f'Bearer {access_token_new_user}'})
         self.assertEqual(response.status_code, 403)
 
+    def test_get_organisation_success(self):
+        response = self.app.get('/api/organisations/testorg', headers={'Authorization': f'Bearer {self.access_token}'})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['data']['orgId'], 'testorg')
+
+    def test_add_existing_member_to_organisation(self):
+        response = self.app.post('/api/organisations/testorg/users', json={'userId': 'anotheruser'}, headers={'Authorization': f'Bearer {self.access_token}'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_organisations_paginated(self):
+        for i in range(3):
+            organisation = Organisation(orgId=f'page{i}', name=f'Page {i}', description='')
+            organisation.users.append(self.user)
+            db.session.add(organisation)
+        db.session.commit()
+
+        seen = []
+        cursor = ''
+        while True:
+            response = self.app.get(f'/api/organisations?limit=2&cursor={cursor}', headers={'Authorization': f'Bearer {self.access_token}'})
+            self.assertEqual(response.status_code, 200)
+            data = response.get_json()['data']
+            self.assertLessEqual(len(data['organisations']), 2)
+            seen.extend(org['orgId'] for org in data['organisations'])
+            if not data['nextCursor']:
+                break
+            cursor = data['nextCursor']
+        self.assertEqual(seen, ['page0', 'page1', 'page2', 'testorg'])
+
+    def test_get_organisations_invalid_limit(self):
+        response = self.app.get('/api/organisations?limit=0', headers={'Authorization': f'Bearer {self.access_token}'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_identity_served_from_model_cache(self):
+        app.config['CACHE_TTL'] = 60
+        model_cache.init_app(app)
+        self.addCleanup(model_cache.init_app, app)
+        self.addCleanup(app.config.__setitem__, 'CACHE_TTL', 0)
+
+        headers = {'Authorization': f'Bearer {self.access_token}'}
+        before = model_cache.stats()['user']
+        self.assertEqual(self.app.get('/api/organisations', headers=headers).status_code, 200)
+        self.assertEqual(model_cache.stats()['user']['miss'], before['miss'] + 1)
+
+        db.session.remove()
+        response = self.app.post('/api/organisations', json={'name': 'Cached Organisation'}, headers=headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(model_cache.stats()['user']['hit'], before['hit'] + 1)
+        self.assertTrue(Membership.is_member('testuser', response.get_json()['data']['orgId']))
+
+    def test_model_cache_invalidated_on_membership_change(self):
+        app.config['CACHE_TTL'] = 60
+        model_cache.init_app(app)
+        self.addCleanup(model_cache.init_app, app)
+        self.addCleanup(app.config.__setitem__, 'CACHE_TTL', 0)
+
+        new_user = User(userId='newuser', firstName='Jane', lastName='Doe', email='jane.doe@example.com', password='password123', phone='0987654321')
+        db.session.add(new_user)
+        db.session.commit()
+
+        headers = {'Authorization': f'Bearer {self.access_token}'}
+        self.assertEqual(self.app.get('/api/organisations/testorg', headers=headers).status_code, 200)
+        self.assertIsNotNone(model_cache.backend.get('organisation:testorg'))
+
+        response = self.app.post('/api/organisations/testorg/users', json={'userId': 'newuser'}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(model_cache.backend.get('organisation:testorg'))
+        self.assertIsNone(model_cache.backend.get('user:newuser'))
+
+    def test_add_users_to_organisation_bulk(self):
+        for i in range(3):
+            db.session.add(User(userId=f'bulk{i}', firstName='Bulk', lastName=str(i), email=f'bulk{i}@example.com', password='password123'))
+        db.session.commit()
+
+        response = self.app.post('/api/organisations/testorg/users', json={'userIds': ['bulk0', 'bulk1', 'anotheruser', 'ghost', 'bulk0', 'bulk2']}, headers={'Authorization': f'Bearer {self.access_token}'})
+        self.assertEqual(response.status_code, 200)
+        results = {r['userId']: r['status'] for r in response.get_json()['data']['results']}
+        self.assertEqual(results, {'bulk0': 'added', 'bulk1': 'added', 'anotheruser': 'alreadyMember', 'ghost': 'notFound', 'bulk2': 'added'})
+        for i in range(3):
+            self.assertTrue(Membership.is_member(f'bulk{i}', 'testorg'))
+
+    def test_add_users_to_organisation_bulk_invalid(self):
+        response = self.app.post('/api/organisations/testorg/users', json={'userIds': []}, headers={'Authorization': f'Bearer {self.access_token}'})
+        self.assertEqual(response.status_code, 400)
+
+    def use_replica(self, uri):
+        replica_router.set_replicas([uri])
+        self.addCleanup(replica_router.set_replicas, [])
+        return replica_router.replicas[0].engine
+
+    def test_reads_routed_to_replica(self):
+        replica_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(replica_dir.cleanup)
+        engine = self.use_replica(f'sqlite:///{replica_dir.name}/replica.db')
+        db.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(User.__table__.insert().values(userId='testuser', firstName='John', lastName='Doe', email='john.doe@example.com', password='x'))
+            conn.execute(Organisation.__table__.insert().values(orgId='replicaorg', name='Replica Organisation', description=''))
+            conn.execute(user_organisation.insert().values(user_id='testuser', organisation_id='replicaorg'))
+        headers = {'Authorization': f'Bearer {self.access_token}'}
+
+        response = self.app.get('/api/organisations', headers=headers)
+        self.assertEqual([org['name'] for org in response.get_json()['data']['organisations']], ['Replica Organisation'])
+
+        # A write pins this user's reads to the primary for REPLICA_STICKY_SECONDS
+        self.app.post('/api/organisations', json={'name': 'New Organisation'}, headers=headers)
+        response = self.app.get('/api/organisations', headers=headers)
+        names = [org['name'] for org in response.get_json()['data']['organisations']]
+        self.assertIn('Test Organisation', names)
+        self.assertIn('New Organisation', names)
+
+        # The signed cookie keeps the pin when the next read lands on a worker that did not see the write
+        replica_router._last_write.clear()
+        response = self.app.get('/api/organisations', headers=headers)
+        self.assertIn('New Organisation', [org['name'] for org in response.get_json()['data']['organisations']])
+        self.app.delete_cookie('replica_pin')
+        response = self.app.get('/api/organisations', headers=headers)
+        self.assertEqual([org['name'] for org in response.get_json()['data']['organisations']], ['Replica Organisation'])
+
+    def test_reads_after_write_sticky_without_cookies(self):
+        replica_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(replica_dir.cleanup)
+        engine = self.use_replica(f'sqlite:///{replica_dir.name}/replica.db')
+        db.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(User.__table__.insert().values(userId='testuser', firstName='John', lastName='Doe', email='john.doe@example.com', password='x'))
+        headers = {'Authorization': f'Bearer {self.access_token}'}
+        client = app.test_client(use_cookies=False)
+
+        # Each request gets its own app context and g, as in production
+        self.app_context.pop()
+        try:
+            self.assertEqual(client.post('/api/organisations', json={'name': 'New Organisation'}, headers=headers).status_code, 201)
+            response = client.get('/api/organisations', headers=headers)
+        finally:
+            self.app_context.push()
+        self.assertIn('New Organisation', [org['name'] for org in response.get_json()['data']['organisations']])
+
+    def test_reads_fall_back_to_primary_when_replica_down(self):
+        self.use_replica('sqlite:////nonexistent/dir/replica.db')
+        check = replica_router.replicas[0].check
+        def unlocked_check(max_lag):
+            # A slow or dead replica must not block other requests' routing
+            self.assertFalse(replica_router._lock.locked())
+            check(max_lag)
+        replica_router.replicas[0].check = unlocked_check
+        response = self.app.get('/api/organisations', headers={'Authorization': f'Bearer {self.access_token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['data']['organisations'][0]['name'], 'Test Organisation')
+        self.assertFalse(replica_router.replicas[0].healthy)
+
+    def test_reads_fall_back_to_primary_when_replica_fails_between_checks(self):
+        replica_dir = tempfile.TemporaryDirectory()
+        engine = self.use_replica(f'sqlite:///{replica_dir.name}/replica.db')
+        replica = replica_router.replicas[0]
+        replica.check(replica_router.max_lag)
+        self.assertTrue(replica.healthy)
+        # Gone before the next scheduled check
+        replica_dir.cleanup()
+        engine.dispose()
+
+        response = self.app.get('/api/organisations', headers={'Authorization': f'Bearer {self.access_token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['data']['organisations'][0]['name'], 'Test Organisation')
+        self.assertFalse(replica.healthy)
+
+    def enable_stateless(self):
+        app.config['JWT_STATELESS'] = True
+        self.addCleanup(app.config.__setitem__, 'JWT_STATELESS', False)
+        self.addCleanup(token_state.cache.clear)
+
+    def test_stateless_token_revocation(self):
+        self.enable_stateless()
+        from app import issue_access_token
+        token = issue_access_token(self.user.userId)
+        headers = {'Authorization': f'Bearer {token}'}
+        self.assertEqual(self.app.get('/api/organisations', headers=headers).status_code, 200)
+
+        token_state.revoke(self.user.userId)
+        db.session.commit()
+        response = self.app.get('/api/organisations', headers=headers)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.get_json()['message'], 'Token has been revoked')
+
+        token = issue_access_token(self.user.userId)
+        self.assertEqual(self.app.get('/api/organisations', headers={'Authorization': f'Bearer {token}'}).status_code, 200)
+
+    def test_logout_revokes_tokens(self):
+        self.enable_stateless()
+        from app import issue_access_token
+        headers = {'Authorization': f'Bearer {issue_access_token(self.user.userId)}'}
+        other_headers = {'Authorization': f'Bearer {issue_access_token(self.user.userId)}'}
+
+        response = self.app.post('/auth/logout', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['message'], 'Logout successful')
+        self.assertEqual(self.app.get('/api/organisations', headers=headers).status_code, 401)
+        self.assertEqual(self.app.get('/api/organisations', headers=other_headers).status_code, 401)
+
+    def test_stateless_skips_user_lookup(self):
+        self.enable_stateless()
+        db.session.execute(user_organisation.delete().where(user_organisation.c.user_id == 'testuser'))
+        db.session.delete(self.user)
+        db.session.commit()
+
+        response = self.app.get('/api/organisations', headers={'Authorization': f'Bearer {self.access_token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['data']['organisations'], [])
+
+    def test_membership_change_bumps_membership_version(self):
+        self.addCleanup(token_state.cache.clear)
+        headers = {'Authorization': f'Bearer {self.access_token}'}
+        db.session.add_all([
+            User(userId='newuser', firstName='Jane', lastName='Doe', email='jane.doe@example.com', password='password123'),
+            User(userId='lateuser', firstName='Late', lastName='Doe', email='late.doe@example.com', password='password123'),
+        ])
+        db.session.commit()
+
+        # Nothing reads the counters while both token modes are off
+        self.app.post('/api/organisations/testorg/users', json={'userId': 'newuser'}, headers=headers)
+        self.assertEqual(db.session.query(TokenVersion).count(), 0)
+
+        self.enable_org_claims()
+        self.app.post('/api/organisations/testorg/users', json={'userId': 'lateuser'}, headers=headers)
+        self.assertEqual(token_state.get('lateuser'), (0, 1))
+
+    def enable_org_claims(self, limit=32):
+        app.config['JWT_ORG_CLAIMS'] = True
+        app.config['JWT_ORG_CLAIM_LIMIT'] = limit
+        self.addCleanup(app.config.__setitem__, 'JWT_ORG_CLAIMS', False)
+        self.addCleanup(app.config.__setitem__, 'JWT_ORG_CLAIM_LIMIT', 32)
+        self.addCleanup(token_state.cache.clear)
+
+    def test_membership_answered_from_token_claims(self):
+        self.enable_org_claims()
+        from app import issue_access_token
+        token = issue_access_token(self.user.userId)
+        headers = {'Authorization': f'Bearer {token}'}
+
+        # Removing the row behind the DB's back shows the claim is what authorised the request
+        db.session.execute(user_organisation.delete().where(user_organisation.c.user_id == 'testuser'))
+        db.session.commit()
+        self.assertEqual(self.app.get('/api/organisations/testorg', headers=headers).status_code, 200)
+
+    def test_stale_membership_claims_fall_back_to_database(self):
+        self.enable_org_claims()
+        from app import issue_access_token
+        other = Organisation(orgId='otherorg', name='Other Organisation', description='')
+        db.session.add(other)
+        db.session.commit()
+        token = issue_access_token(self.user.userId)
+        headers = {'Authorization': f'Bearer {token}'}
+        self.assertEqual(self.app.get('/api/organisations/otherorg', headers=headers).status_code, 403)
+
+        another_token = create_access_token(identity=self.another_user.userId)
+        self.app.post('/api/organisations', json={'name': 'Shared'}, headers={'Authorization': f'Bearer {another_token}'})
+        shared = Organisation.query.filter_by(name='Shared').first()
+        self.app.post(f'/api/organisations/{shared.orgId}/users', json={'userId': 'testuser'}, headers={'Authorization': f'Bearer {another_token}'})
+        self.assertEqual(self.app.get(f'/api/organisations/{shared.orgId}', headers=headers).status_code, 200)
+
+    def test_membership_claims_overflow(self):
+        self.enable_org_claims(limit=0)
+        from app import issue_access_token
+        from flask_jwt_extended import decode_token
+        claims = decode_token(issue_access_token(self.user.userId))
+        self.assertTrue(claims['orgs_overflow'])
+        self.assertNotIn('orgs', claims)
+
+    def test_verified_claims_cached_per_token(self):
+        jwt.clear_decode_cache()
+        self.addCleanup(jwt.clear_decode_cache)
+        headers = {'Authorization': f'Bearer {self.access_token}'}
+        hits, misses = decode_cache_requests.value(result='hit'), decode_cache_requests.value(result='miss')
+        self.assertEqual(self.app.get('/api/organisations', headers=headers).status_code, 200)
+        self.assertEqual(self.app.get('/api/organisations', headers=headers).status_code, 200)
+        self.assertEqual(decode_cache_requests.value(result='miss'), misses + 1)
+        self.assertEqual(decode_cache_requests.value(result='hit'), hits + 1)
+
+        tampered = self.access_token[:-2] + ('AA' if not self.access_token.endswith('AA') else 'BB')
+        response = self.app.get('/api/organisations', headers={'Authorization': f'Bearer {tampered}'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.get_json()['message'], 'Invalid JWT token')
+
+        # Past its exp a cached entry is dropped and the token is decoded from scratch
+        exp = jwt._decode_jwt_from_config(self.access_token)['exp']
+        with mock.patch('tokens.time.time', return_value=exp + 1):
+            jwt._decode_jwt_from_config(self.access_token)
+        self.assertEqual(decode_cache_requests.value(result='miss'), misses + 3)
+
+    def test_conditional_get_with_etags(self):
+        headers = {'Authorization': f'Bearer {self.access_token}'}
+        newcomer = User(userId='newcomer', firstName='New', lastName='Comer', email='new@example.com', password='password123')
+        db.session.add(newcomer)
+        db.session.commit()
+        urls = ['/api/organisations/testorg', '/api/organisations', '/api/users/anotheruser']
+        etags = {}
+        for url in urls:
+            response = self.app.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            etags[url] = response.headers['ETag']
+            response = self.app.get(url, headers=dict(headers, **{'If-None-Match': etags[url]}))
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response.get_data(), b'')
+            self.assertEqual(response.headers['ETag'], etags[url])
+
+        # A membership change bumps the organisation's version, and the caller's list when it is the one joining
+        self.app.post('/api/organisations/testorg/users', json={'userId': 'newcomer'}, headers=headers)
+        self.app.post('/api/organisations', json={'name': 'Second'}, headers=headers)
+        # Creating an organisation only touches its members, the new row keeps its initial version
+        self.assertEqual(Organisation.query.filter_by(name='Second').one().version, 1)
+        for url in urls[:2]:
+            response = self.app.get(url, headers=dict(headers, **{'If-None-Match': etags[url]}))
+            self.assertEqual(response.status_code, 200, url)
+            self.assertNotEqual(response.headers['ETag'], etags[url])
+
+        # A stale tag never bypasses the permission check
+        response = self.app.get('/api/users/anotheruser', headers={
+            'Authorization': f'Bearer {create_access_token(identity="nobody")}', 'If-None-Match': etags['/api/users/anotheruser']})
+        self.assertNotEqual(response.status_code, 304)
+
+    def test_stream_organisation_users(self):
+        headers = {'Authorization': f'Bearer {self.access_token}'}
+        response = self.app.get('/api/organisations/testorg/users', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        data = response.get_json()
+        self.assertEqual([member['userId'] for member in data['data']['users']], ['anotheruser', 'testuser'])
+        self.assertIsNone(data['data']['nextCursor'])
+
+        response = self.app.get('/api/organisations/testorg/users?format=ndjson&limit=1', headers=headers)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(lines[0]['userId'], 'anotheruser')
+        self.assertNotIn('password', lines[0])
+        response = self.app.get(f'/api/organisations/testorg/users?limit=1&cursor={lines[1]["nextCursor"]}',
+                                headers=dict(headers, Accept='application/x-ndjson'))
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(lines, [dict(lines[0], userId='testuser')])
+
+        response = self.app.get('/api/organisations/testorg/users', headers=dict(headers, **{'Accept-Encoding': 'gzip'}))
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(response.get_data()))['data']['users']), 2)
+
+    def test_stream_organisation_users_errors(self):
+        headers = {'Authorization': f'Bearer {self.access_token}'}
+        self.assertEqual(self.app.get('/api/organisations/testorg/users?format=xml', headers=headers).status_code, 400)
+        self.assertEqual(self.app.get('/api/organisations/testorg/users?limit=0', headers=headers).status_code, 400)
+        self.assertEqual(self.app.get('/api/organisations/missing/users', headers=headers).status_code, 404)
+        db.session.add(User(userId='outsider', firstName='Out', lastName='Sider', email='out@example.com', password='password123'))
+        db.session.commit()
+        outsider = {'Authorization': f'Bearer {create_access_token(identity="outsider")}'}
+        self.assertEqual(self.app.get('/api/organisations/testorg/users', headers=outsider).status_code, 403)
+
+    def test_search_organisations(self):
+        headers = {'Authorization': f'Bearer {self.access_token}'}
+        for org_id, name, member in [('acme', 'Acme Rockets', True), ('acme-secret', 'Acme Secret Labs', False),
+                                     ('pacific', 'Pacific Acme Traders', True)]:
+            organisation = Organisation(orgId=org_id, name=name, description='')
+            if member:
+                organisation.users.append(self.user)
+            db.session.add(organisation)
+        db.session.commit()
+
+        def search(q):
+            response = self.app.get('/api/organisations/search', query_string={'q': q}, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            return [org['orgId'] for org in response.get_json()['data']['organisations']]
+
+        # Prefix matches first, then fuzzy ones; other people's organisations never show up.
+        # A scan limit of 0 sends SQLite through the FTS table instead of the membership scan
+        self.addCleanup(app.config.__setitem__, 'SEARCH_SCAN_LIMIT', app.config['SEARCH_SCAN_LIMIT'])
+        for scan_limit in (10000, 0):
+            app.config['SEARCH_SCAN_LIMIT'] = scan_limit
+            self.assertEqual(search('acme'), ['acme', 'pacific'])
+            self.assertEqual(search('rokets'), [])
+            self.assertEqual(search('rocket'), ['acme'])
+            self.assertEqual(search('Acme Rokcets'), ['acme'])
+            self.assertEqual(search('te'), ['testorg'])
+            self.assertEqual(search('100%'), [])
+
+        db.session.get(Organisation, 'acme').name = 'Zenith'
+        db.session.commit()
+        self.assertEqual(search('acme'), ['pacific'])
+        self.assertEqual(self.app.get('/api/organisations/search', headers=headers).status_code, 400)
+
+    def test_search_threshold_applied_on_postgresql(self):
+        from sqlalchemy.dialects import postgresql
+        from search import OrganisationSearch
+        with mock.patch.object(db.session, 'get_bind') as get_bind, mock.patch.object(db.session, 'execute') as execute:
+            get_bind.return_value.dialect.name = 'postgresql'
+            OrganisationSearch.search('testuser', 'quantum', threshold=0.3)
+        statements = [str(call.args[0].compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+                      for call in execute.call_args_list]
+        self.assertIn("set_config('pg_trgm.word_similarity_threshold', '0.3', true)", statements[0])
+        self.assertIn('<%', statements[1])
+
+    def test_json_provider_without_orjson(self):
+        headers = {'Authorization': f'Bearer {self.access_token}'}
+        fast = self.app.get('/api/organisations/testorg', headers=headers)
+        with mock.patch('serializers.orjson', None):
+            fallback = self.app.get('/api/organisations/testorg', headers=headers)
+        self.assertEqual(fast.get_json(), fallback.get_json())
+        self.assertEqual(list(fast.get_json()), ['status', 'message', 'data'])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+from sqlalchemy.pool import NullPool
+from pooling import engine_options
+
+class EngineOptionsTestCase(unittest.TestCase):
+
+    def test_sqlite_left_to_flask_sqlalchemy(self):
+        self.assertEqual(engine_options('sqlite:///:memory:', {'DB_POOL_SIZE': '20'}), {})
+
+    def test_queue_pool_settings(self):
+        options = engine_options('postgresql://localhost/hng', {'DB_POOL_SIZE': '20', 'DB_POOL_RECYCLE': '60', 'DB_POOL_PRE_PING': 'false'})
+        self.assertEqual(options['pool_size'], 20)
+        self.assertEqual(options['max_overflow'], 10)
+        self.assertEqual(options['pool_recycle'], 60)
+        self.assertFalse(options['pool_pre_ping'])
+        self.assertNotIn('poolclass', options)
+
+    def test_null_pool_on_vercel(self):
+        options = engine_options('postgresql://localhost/hng', {'VERCEL': '1'})
+        self.assertIs(options['poolclass'], NullPool)
+        self.assertNotIn('pool_size', options)
+        self.assertEqual(options['connect_args']['connect_timeout'], 5)
+
+    def test_explicit_mode_overrides_vercel(self):
+        options = engine_options('postgresql://localhost/hng', {'VERCEL': '1', 'DB_POOL_MODE': 'queue'})
+        self.assertIn('pool_size', options)
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            engine_options('postgresql://localhost/hng', {'DB_POOL_MODE': 'bogus'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import json
+import os
+import unittest
+from sqlalchemy import event
+from app import app, db
+from models import User, Organisation
+from membership import Membership
+from search import OrganisationSearch
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class QueryPlanTestCase(unittest.TestCase):
+    """Membership and listing queries must be answered from an index on every backend we run."""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('TEST_URI')
+
+        self.app_context = app.app_context()
+        self.app_context.push()
+
+        db.create_all()
+
+        self.user = User(userId='testuser', firstName='John', lastName='Doe', email='john.doe@example.com', password='password123')
+        self.another_user = User(userId='anotheruser', firstName='Jane', lastName='Doe', email='jane.doe@example.com', password='password123')
+        self.organisation = Organisation(orgId='testorg', name='Test Organisation', description='A test organisation')
+        self.organisation.users.append(self.user)
+        self.organisation.users.append(self.another_user)
+        db.session.add(self.organisation)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def capture(self, fn):
+        """Run ``fn`` and return the (statement, parameters) pairs it sent to the database."""
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            fn()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertTrue(statements)
+        return statements
+
+    def explain(self, statement, parameters):
+        with db.engine.connect() as conn:
+            if db.engine.dialect.name == 'postgresql':
+                # Tiny test tables make a sequential scan cheapest; we only care that an index is usable
+                conn.exec_driver_sql('SET enable_seqscan = off')
+                rows = conn.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + statement, parameters).all()
+                return json.dumps(rows[0][0])
+            rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+            return '\n'.join(row[-1] for row in rows)
+
+    def assertIndexed(self, fn):
+        for statement, parameters in self.capture(fn):
+            plan = self.explain(statement, parameters)
+            if db.engine.dialect.name == 'postgresql':
+                self.assertNotIn('Seq Scan', plan, statement)
+            else:
+                lines = plan.splitlines()
+                # Reading back a materialised CTE is fine; its own plan lines are checked too
+                allowed = {'SCAN CONSTANT ROW'} | {'SCAN ' + line.split()[1] for line in lines if line.startswith('MATERIALIZE ')}
+                for line in lines:
+                    # FTS5 reports its own index lookups as a virtual table scan
+                    if line not in allowed and 'VIRTUAL TABLE INDEX' not in line:
+                        self.assertFalse(line.startswith('SCAN '), f'{line}\n{statement}')
+
+    def test_is_member_uses_index(self):
+        self.assertIndexed(lambda: Membership.is_member('testuser', 'testorg'))
+
+    def test_shares_organisation_uses_index(self):
+        self.assertIndexed(lambda: Membership.shares_organisation('testuser', 'anotheruser'))
+
+    def test_visible_users_uses_index(self):
+        self.assertIndexed(lambda: Membership.visible_users('testuser', ['anotheruser', 'testuser']))
+
+    def test_organisations_page_uses_index(self):
+        self.assertIndexed(lambda: Membership.organisations_page('testuser', after='a', limit=10))
+
+    def test_members_page_uses_reverse_index(self):
+        self.assertIndexed(lambda: db.session.execute(Membership.members_query('testorg', after='a', limit=10)).all())
+
+    def test_organisation_search_uses_name_index(self):
+        self.assertIndexed(lambda: OrganisationSearch.search('testuser', 'organisation', scan_limit=0))
+
+    def test_organisation_users_uses_reverse_index(self):
+        db.session.expire_all()
+        organisation = db.session.get(Organisation, 'testorg')
+        self.assertIndexed(lambda: organisation.users)
+
+if __name__ == '__main__':
+    unittest.main()
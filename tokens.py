@@ -0,0 +1,193 @@
+import base64
+import hashlib
+import time
+import uuid
+
+from flask_jwt_extended import JWTManager
+from sqlalchemy import insert, select, update
+from models import db, TokenVersion, user_organisation
+from cache import LRUCache
+from metrics import registry
+
+decode_cache_requests = registry.counter('jwt_decode_cache_total', 'Verified-token cache lookups', ('result',))
+
+
+def compact_org_id(org_id):
+    """22-character form of a canonical UUID orgId; other ids are kept as they are."""
+    try:
+        parsed = uuid.UUID(org_id)
+    except ValueError:
+        return org_id
+    if str(parsed) != org_id:
+        return org_id
+    return base64.urlsafe_b64encode(parsed.bytes).decode().rstrip('=')
+
+
+class TokenIdentity():
+    """Stand-in for ``User`` on the stateless path, built from verified token claims only."""
+
+    def __init__(self, claims, identity_claim='sub'):
+        self.userId = claims[identity_claim]
+        self.claims = claims
+
+
+class TokenState():
+    """Per-user token and membership version counters from the ``token_version`` table.
+
+    ``version`` is bumped to revoke every token issued to a user so far;
+    ``membership_version`` is bumped whenever the user's organisations change,
+    which lets claims about memberships be recognised as stale. Users without a
+    row are at (0, 0). Reads go through a short-TTL LRU, so a revocation takes
+    up to ``TOKEN_STATE_CACHE_TTL`` seconds to reach other processes.
+    """
+
+    def __init__(self, app=None):
+        self.cache = LRUCache(maxsize=10000, ttl=5)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TOKEN_STATE_CACHE_TTL', 5)
+        self.cache = LRUCache(maxsize=10000, ttl=float(app.config['TOKEN_STATE_CACHE_TTL']))
+        app.extensions['token_state'] = self
+
+    def get(self, user_id):
+        state = self.cache.get(user_id)
+        if state is None:
+            row = db.session.execute(
+                select(TokenVersion.version, TokenVersion.membership_version).where(TokenVersion.user_id == user_id)
+            ).first()
+            state = tuple(row) if row else (0, 0)
+            self.cache.set(user_id, state)
+        return state
+
+    def claims(self, user_id):
+        version, membership_version = self.get(user_id)
+        return {'ver': version, 'mver': membership_version}
+
+    @staticmethod
+    def org_ids_query(user_id, limit):
+        return (
+            select(user_organisation.c.organisation_id)
+            .where(user_organisation.c.user_id == user_id)
+            .order_by(user_organisation.c.organisation_id)
+            .limit(limit + 1)
+        )
+
+    @staticmethod
+    def org_claims(org_ids, limit):
+        """``orgs`` claim for up to ``limit`` memberships, or ``orgs_overflow`` beyond that."""
+        org_ids = list(org_ids)
+        if len(org_ids) > limit:
+            return {'orgs_overflow': True}
+        return {'orgs': sorted(compact_org_id(org_id) for org_id in org_ids)}
+
+    def membership_claims(self, user_id, limit):
+        # Read the counters first: a membership added in between then makes the token stale, not wrong
+        claims = self.claims(user_id)
+        claims.update(self.org_claims(db.session.scalars(self.org_ids_query(user_id, limit)), limit))
+        return claims
+
+    def claimed_membership(self, claims, org_id, identity_claim='sub'):
+        """Answer a membership check from token claims: True, False, or None when the DB must decide.
+
+        Listed orgs are trusted as memberships are never removed, and revoking
+        the token covers anything else. An absent org is only a definitive "no"
+        while the user's membership version still matches the token's.
+        """
+        orgs = claims.get('orgs')
+        if orgs is None:
+            return None
+        if compact_org_id(org_id) in orgs:
+            return True
+        _, membership_version = self.get(claims[identity_claim])
+        if claims.get('mver', 0) == membership_version:
+            return False
+        return None
+
+    def is_revoked(self, claims, identity_claim='sub'):
+        version, _ = self.get(claims[identity_claim])
+        return claims.get('ver', 0) < version
+
+    @staticmethod
+    def bump_statement(column, user_ids):
+        return update(TokenVersion).where(TokenVersion.user_id.in_(user_ids)).values({column: column + 1})
+
+    @staticmethod
+    def existing_query(user_ids):
+        return select(TokenVersion.user_id).where(TokenVersion.user_id.in_(user_ids))
+
+    @staticmethod
+    def missing_rows(column, user_ids, existing):
+        """Rows to insert for users that had no counters yet, already bumped once."""
+        rows = [{'user_id': user_id, 'version': 0, 'membership_version': 0} for user_id in user_ids if user_id not in existing]
+        for row in rows:
+            row[column.key] = 1
+        return rows
+
+    def _bump(self, column, user_ids):
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return
+        db.session.execute(self.bump_statement(column, user_ids))
+        existing = set(db.session.scalars(self.existing_query(user_ids)))
+        rows = self.missing_rows(column, user_ids, existing)
+        if rows:
+            db.session.execute(insert(TokenVersion), rows)
+        for user_id in user_ids:
+            self.cache.delete(user_id)
+
+    def revoke(self, user_id):
+        """Invalidate all of ``user_id``'s outstanding tokens; the caller commits."""
+        self._bump(TokenVersion.version, [user_id])
+
+    def memberships_changed(self, user_ids):
+        """Record that these users' memberships changed; the caller commits."""
+        self._bump(TokenVersion.membership_version, user_ids)
+
+
+token_state = TokenState()
+
+
+class CachingJWTManager(JWTManager):
+    """``JWTManager`` that remembers verified claims per raw token until the token expires.
+
+    Entries are keyed by a SHA-256 of the token, so an altered token never
+    matches. A hit skips the signature check and claim parsing; the blocklist
+    and user lookup loaders still run on every request. Expired, not-yet-valid
+    and CSRF-bound tokens always take the normal decode path and its errors.
+    ``JWT_DECODE_CACHE_SIZE = 0`` turns the cache off.
+    """
+
+    def __init__(self, app=None, add_context_processor=False):
+        self.decode_cache = LRUCache(maxsize=4096, ttl=0)
+        super().__init__(app, add_context_processor)
+
+    def init_app(self, app, add_context_processor=False):
+        super().init_app(app, add_context_processor)
+        app.config.setdefault('JWT_DECODE_CACHE_SIZE', 4096)
+        self.decode_cache = LRUCache(maxsize=int(app.config['JWT_DECODE_CACHE_SIZE']), ttl=0)
+
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None, allow_expired=False):
+        if csrf_value is not None or allow_expired or not self.decode_cache.maxsize:
+            return super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+
+        key = hashlib.sha256(encoded_token.encode()).hexdigest()
+        claims = self.decode_cache.get(key)
+        if claims is not None:
+            if 'exp' not in claims or claims['exp'] > time.time():
+                decode_cache_requests.inc(result='hit')
+                return dict(claims)
+            self.decode_cache.delete(key)
+        decode_cache_requests.inc(result='miss')
+
+        claims = super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+        now = time.time()
+        # Tokens only accepted thanks to JWT_DECODE_LEEWAY are not worth keeping
+        if claims.get('nbf', now) <= now and claims.get('exp', now + 1) > now:
+            self.decode_cache.set(key, dict(claims), claims['exp'] - now if 'exp' in claims else 3600)
+        return claims
+
+    def clear_decode_cache(self):
+        self.decode_cache.clear()
+
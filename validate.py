@@ -1,12 +1,15 @@
 from flask import jsonify
 from werkzeug.exceptions import BadRequest
+from sqlalchemy import exists, select
 from models import db, User, Organisation
+from cache import model_cache
+from emailfilter import email_filter
 import uuid
 
 class Validate():
 
     @staticmethod
-    def validate_user(data):
+    def user_errors(data):
         errors = []
         if not data.get('firstName'):
             errors.append({'field': 'firstName', 'message': 'First name is required'})
@@ -16,27 +19,42 @@ class Validate():
             errors.append({'field': 'email', 'message': 'Email is required'})
         if not data.get('password'):
             errors.append({'field': 'password', 'message': 'Password is required'})
+        return errors
+
+    @staticmethod
+    def validate_user(data):
+        errors = Validate.user_errors(data)
         if errors:
             return jsonify({'errors': errors}), 422
         return data
     
+    @staticmethod
+    def default_organisation(first_name, last_name):
+        return {
+            'orgId': str(uuid.uuid4()),
+            'name': f"{first_name}'s Organisation",
+            'description': f"{first_name} {last_name}'s organisation"
+        }
+
+    @staticmethod
+    def email_registered(email):
+        return db.session.execute(select(exists().where(User.email == email))).scalar()
+
     @staticmethod
     def save_user(user_data):
         user = User(**user_data)
+
+        # Create an organisation for the user; user, organisation and membership
+        # are flushed together and committed once
+        organisation_data = Validate.default_organisation(user.firstName, user.lastName)
+        user.organisations.append(Organisation(**organisation_data))
         try:
             db.session.add(user)
             db.session.commit()
-
-            # Create an organisation for the user
-            organisation_name = f"{user.firstName}'s Organisation"
-            organisation = Organisation(
-                orgId=str(uuid.uuid4()),
-                name=organisation_name,
-                description=f"{user.firstName} {user.lastName}'s organisation"
-            )
-            user.organisations.append(organisation)
-            db.session.add(organisation)
-            db.session.commit()
+            # Read keys from the input dicts; the committed instances are expired
+            model_cache.invalidate_user(user_data['userId'])
+            email_filter.add(user_data['email'])
+            model_cache.invalidate_organisation(organisation_data['orgId'])
 
         except Exception as e:
             db.session.rollback()